@@ -0,0 +1,612 @@
+import io
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import tempfile
+import contextlib
+from array import array
+from typing import List, Tuple
+
+import parse
+from parse import np, Page, PageMap, FreeList, BBVBase, FIRST_PN, PAGE_SIZE
+from parse import index_log, convert_log, MakeHelper, SRC_DIR
+from parse import TRACE, TRACE_EXECUTE, TRACE_SYSCALL, TRACE_STOP
+
+parser = argparse.ArgumentParser()
+parser.add_argument('bench', nargs='*')
+parser.add_argument('-n', '--pages', type=int, default=50000)
+parser.add_argument('-s', '--seed', type=int, default=0)
+parser.add_argument('--exec', help='take cfis of bbv from this binary')
+parser.add_argument('--scales', default='256,1024,4096',
+                    help='pages per checkpoint of each pipeline run')
+parser.add_argument('--checkpoints', type=int, default=8,
+                    help='checkpoints in the log of the pipeline')
+parser.add_argument('--syscalls', type=float, default=0.25,
+                    help='syscalls per page of the pipeline')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='jobs of parse.main in the pipeline')
+parser.add_argument('--toolchain', action='store_true',
+                    help='also run parse.main building stubs with make')
+parser.add_argument('--save', metavar='JSON', help='save the results here')
+parser.add_argument('--compare', metavar='JSON',
+                    help='compare the results with those saved here')
+
+ZERO_PAGE = b'\0' * PAGE_SIZE
+HEAP_PN = 0x4000  # data pages of the pipeline
+BREAK_REPEAT = 4
+
+RESULTS = {}  # seconds of each measurement
+
+# stand-ins for the toolchain, rv-sim, spike and cl, put on PATH by
+# the pipeline
+FAKE_MAKE = '''#!/usr/bin/env python3
+# make of the stubs, encoded by parse.py instead of assembled
+import sys
+sys.modules['numpy'] = None  # slow to import and not needed
+sys.path.insert(0, %r)
+from parse import Encoder
+
+target = sys.argv[1]
+var = dict(arg.split('=', 1) for arg in sys.argv[2:])
+kind = target[:-len('00000000.bin')]
+if kind == 'jump':
+    data = Encoder.jump(int(var['OFFSET']))
+elif kind == 'near':
+    alter_rd = None
+    if 'ALTER_RD_IS_SP' in var:
+        alter_rd = 2
+    elif 'ALTER_RD' in var:
+        alter_rd = int(var['ALTER_RD'][1:])
+    far_pc = int(var['FAR_CALL'], 16) if 'FAR_CALL' in var else None
+    data = Encoder.near(int(var['NEAR_BUF'], 16), far_pc, alter_rd)
+else:
+    data = Encoder.far(int(var['REPLAY_SP'], 16), int(var['REPLAY_PC'], 16))
+with open(target, 'wb') as f:
+    f.write(data)
+''' % os.path.abspath(SRC_DIR)
+
+FAKE_RV_SIM = '''#!/bin/sh
+# rv-sim -M <addr> -L <repeat> -- cl <cfg> <dump>, printing what
+# main.c and cl print before the trace saved next to the checkpoint
+while [ $# -gt 2 ]; do shift; done
+printf 'map cl to 0x10000-0x1ffff\\nmap mc to 0x20000-0x20fff\\n'
+printf 'invoke cl\\nbegin execution\\n'
+exec cat "${1%.1.cfg}.trace"
+'''
+
+FAKE_SPIKE = '''#!/bin/sh
+# spike [--instructions=<n>] pk cl <cfg> <dump>, reading the dump once
+while [ $# -gt 2 ]; do shift; done
+cat "$2" > /dev/null
+printf 'invoke cl\\nfinish\\ncycle %016x\\ninstret %016x\\n' 1 1
+'''
+
+
+def make_bitmap(rng: random.Random) -> int:
+    kind = rng.random()
+    if kind < 0.3:  # fully touched, e.g. data pages
+        return (1 << PAGE_SIZE) - 1
+    if kind < 0.4:  # barely touched, e.g. stack or heap pages
+        return 0
+    # code pages with fragmented holes
+    bitmap = 0
+    offs = 0
+    while offs < PAGE_SIZE:
+        used = rng.choice([2, 4, 4, 8, 64, 256])
+        free = rng.choice([2, 2, 4, 16, 64, 512])
+        used = min(used, PAGE_SIZE - offs)
+        bitmap |= ((1 << used) - 1) << offs
+        offs += used + free
+    return bitmap
+
+
+def make_page_map(num_pages: int, seed: int) -> PageMap:
+    rng = random.Random(seed)
+    pages = PageMap()
+    pn = FIRST_PN
+    for _ in range(num_pages):
+        pages[pn] = Page(make_bitmap(rng), ZERO_PAGE)
+        pn += 1 if rng.random() < 0.9 else rng.randint(2, 64)
+    return pages
+
+
+def make_free_list_bytewise(pages: PageMap) -> List[Tuple[int, int]]:
+    # the original implementation, testing one bit per iteration
+    free_list = []
+    page_list = sorted(pages._map.items())
+    cur = FIRST_PN * PAGE_SIZE
+
+    for pn, page in page_list:
+        pa = pn * PAGE_SIZE
+        for i in range(PAGE_SIZE):
+            free = page.is_free(i)
+            if cur is None and free:  # begin a free range
+                cur = pa + i
+            elif cur is not None and not free:  # end
+                begin = (cur + 1) & ~1
+                end = (pa + i) & ~1
+                if begin < end:
+                    free_list.append((begin, end))
+                cur = None
+
+    return free_list
+
+
+def reserve_linear(free_list: List[Tuple[int, int]],
+                   base_addr: int, size: int) -> int:
+    # the original implementation, scanning the list for a fit
+    if base_addr < free_list[0][0]:
+        s, e = -1, 0
+    elif base_addr >= free_list[-1][1]:
+        s, e = len(free_list) - 1, len(free_list)
+    else:
+        s, e = 0, len(free_list) - 1
+        while s + 1 < e:
+            m = (s + e) // 2
+            if free_list[m][1] <= base_addr:
+                s = m
+            elif free_list[m][0] > base_addr:
+                e = m
+
+    s_hit, e_hit = False, False
+    while True:
+        do_s = s >= 0 and not s_hit
+        do_e = e < len(free_list) and not e_hit
+        if not (do_s or do_e):
+            break
+        if do_s:
+            if free_list[s][0] + size <= free_list[s][1]:
+                s_hit = True
+            else:
+                s -= 1
+        if do_e:
+            if free_list[e][1] - size >= free_list[e][0]:
+                e_hit = True
+            else:
+                e += 1
+
+    if s_hit and e_hit:
+        s_dist = base_addr - free_list[s][1]
+        e_dist = free_list[e][0] - base_addr
+        use_i = s if s_dist < e_dist else e
+    elif s_hit:
+        use_i = s
+    elif e_hit:
+        use_i = e
+    else:
+        raise Exception('failed to reserve')
+
+    begin, end = free_list[use_i]
+    if begin > base_addr:
+        free_list[use_i] = (begin + size, end)
+        return begin
+    free_list[use_i] = (begin, end - size)
+    return end - size
+
+
+def make_sites(free_list: List[Tuple[int, int]], num_sites: int,
+               seed: int) -> List[int]:
+    # syscall sites lie on used bytes, i.e. between free ranges, and
+    # crowd into a hot region so that nearby holes run out
+    rng = random.Random(seed)
+    sites = []
+    hot = min(len(free_list), 64)
+    first = rng.randrange(1, len(free_list) - hot + 1)
+    for _ in range(num_sites):
+        i = rng.randrange(first, first + hot - 1)
+        sites.append(rng.randrange(free_list[i - 1][1], free_list[i][0]))
+    return sites
+
+
+def make_bbv_base(num_pages: int, seed: int) -> BBVBase:
+    # a cfi about every 12 bytes, like compiled code
+    rng = random.Random(seed)
+    pcs = []
+    pc = FIRST_PN * PAGE_SIZE
+    for _ in range(num_pages * PAGE_SIZE // 12):
+        pc += rng.choice([2, 4]) * rng.randint(1, 5)
+        pcs.append(pc)
+    bbv = BBVBase.__new__(BBVBase)
+    bbv.set_cfis(np.array(pcs, dtype=np.int64))
+    return bbv
+
+
+def make_exec_pages(bbv: BBVBase, num_pages: int, seed: int) -> PageMap:
+    rng = np.random.default_rng(seed)
+    pns = np.unique(bbv.pns)
+    pns = rng.choice(pns, min(num_pages, len(pns)), replace=False)
+    pages = PageMap()
+    for pn in sorted(pns.tolist()):
+        count = rng.integers(0, 1 << 20, PAGE_SIZE // 2, dtype=np.uint32)
+        count[rng.random(PAGE_SIZE // 2) < 0.7] = 0
+        pages[pn] = Page((1 << PAGE_SIZE) - 1, ZERO_PAGE)
+        pages[pn].set_exec_count(count.tobytes())
+    return pages
+
+
+def dump_bbv_slotwise(pages: PageMap, bbv: BBVBase, f: io.StringIO):
+    # the original implementation, looking up every executed slot
+    cfi_map = dict(zip(bbv.pcs.tolist(), bbv.indexes.tolist()))
+    page_list = sorted(pages._map.items())
+    f.write('T')
+    for pn, page in page_list:
+        if page.exec_count is None:
+            continue
+        for i, count in enumerate(page.exec_count):
+            if not count:
+                continue
+            pc = pn * PAGE_SIZE + i * 2
+            index = cfi_map.get(pc)
+            if index is not None:
+                f.write(':%d:%d ' % (index, count))
+    f.write('\n')
+
+
+def make_text_log(path: str, num_syscalls: int, seed: int):
+    # a syscall-heavy checkpoint, half of the syscalls writing memory
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write('begin 0x%x\n' % (FIRST_PN * PAGE_SIZE))
+        for name in ['ireg', 'freg']:
+            regs = tuple(rng.getrandbits(64) for _ in range(32))
+            f.write(name + ' %x' * 32 % regs + '\n')
+        for _ in range(num_syscalls):
+            addr = (FIRST_PN * PAGE_SIZE) + rng.randrange(1 << 16) * 4
+            if rng.random() < 0.5:
+                f.write('syscall 0x%x %x\n' % (addr, rng.getrandbits(64)))
+                continue
+            size = rng.choice([8, 64, 144, 512, 4096])
+            waddr = rng.randrange(1 << 32, 1 << 40)
+            f.write('syscall 0x%x %x 0x%x %s\n' % (
+                addr, size, waddr, rng.randbytes(size).hex()))
+        f.write('break 0x%x first\n' % (FIRST_PN * PAGE_SIZE))
+        f.write('file checkpoint.dump\n')
+
+
+def load_syscalls(logpath: str) -> list:
+    syscalls = []
+    for block in index_log(logpath, None):
+        syscalls += block.load().syscalls
+    return syscalls
+
+
+def timeit(func, *args):
+    begin = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - begin, result
+
+
+def bench_freelist(args):
+    pages = make_page_map(args.pages, args.seed)
+    print('freelist: %d pages' % args.pages)
+    t_new, new = timeit(pages.make_free_list)
+    print('  wordwise  %8.3fs  %d ranges' % (t_new, len(new)))
+    t_old, old = timeit(make_free_list_bytewise, pages)
+    print('  bytewise  %8.3fs  %d ranges' % (t_old, len(old)))
+    assert new == old, 'free lists differ'
+    print('  speedup   %8.1fx' % (t_old / t_new))
+    RESULTS.update({'freelist.wordwise': t_new, 'freelist.bytewise': t_old})
+
+
+def bench_reserve(args):
+    pages = make_page_map(args.pages, args.seed)
+    ranges = pages.make_free_list()
+    sites = make_sites(ranges, args.pages // 4, args.seed)
+    print('reserve: %d ranges, %d sites' % (len(ranges), len(sites)))
+
+    def run_linear():
+        free_list = ranges.copy()
+        return [reserve_linear(free_list, addr, 36) for addr in sites]
+
+    t_build, free_list = timeit(FreeList, ranges)
+    print('  build     %8.3fs' % t_build)
+    t_new, new = timeit(lambda: [free_list.take(a, 36) for a in sites])
+    print('  tree      %8.3fs' % t_new)
+    t_old, old = timeit(run_linear)
+    print('  linear    %8.3fs' % t_old)
+    assert new == old, 'reservations differ'
+    print('  speedup   %8.1fx' % (t_old / t_new))
+    RESULTS.update({'reserve.tree': t_new, 'reserve.linear': t_old})
+
+
+def bench_bbv(args):
+    if args.exec:
+        bbv = BBVBase(args.exec)
+    else:
+        bbv = make_bbv_base(args.pages, args.seed)
+    pages = make_exec_pages(bbv, args.pages, args.seed)
+    print('bbv: %d cfis, %d exec pages' % (len(bbv.pcs), len(pages._map)))
+
+    new, old = io.StringIO(), io.StringIO()
+    t_new, _ = timeit(pages.dump_bbv, bbv, new)
+    print('  gathered  %8.3fs' % t_new)
+    t_old, _ = timeit(dump_bbv_slotwise, pages, bbv, old)
+    print('  slotwise  %8.3fs' % t_old)
+    assert new.getvalue() == old.getvalue(), 'bbvs differ'
+    print('  speedup   %8.1fx' % (t_old / t_new))
+    RESULTS.update({'bbv.gathered': t_new, 'bbv.slotwise': t_old})
+
+
+def bench_parse(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        textpath = os.path.join(tmpdir, 'bench.cpt')
+        binpath = os.path.join(tmpdir, 'bench.bcpt')
+        make_text_log(textpath, args.pages, args.seed)
+        convert_log(textpath, binpath)
+        print('parse: %d syscalls, text %d bytes, binary %d bytes' % (
+            args.pages, os.path.getsize(textpath), os.path.getsize(binpath)))
+
+        t_new, new = timeit(load_syscalls, binpath)
+        print('  binary    %8.3fs' % t_new)
+        t_old, old = timeit(load_syscalls, textpath)
+        print('  text      %8.3fs' % t_old)
+
+        def fields(syscalls):
+            return [(s.addr, s.retval, s.waddr, s.wdata and bytes(s.wdata),
+                     s.is_break) for s in syscalls]
+        assert fields(new) == fields(old), 'syscalls differ'
+        print('  speedup   %8.1fx' % (t_old / t_new))
+        RESULTS.update({'parse.binary': t_new, 'parse.text': t_old})
+
+
+def make_data(rng: random.Random, code: bool) -> bytes:
+    # about what pages of a process hold
+    kind = rng.random()
+    if kind < 0.3 and not code:  # untouched heap and stack
+        return ZERO_PAGE
+    if kind < 0.35 and not code:
+        return bytes([rng.randrange(1, 256)]) * PAGE_SIZE
+    if kind < 0.7:  # repetitive, e.g. code and tables
+        return rng.randbytes(256) * (PAGE_SIZE // 256)
+    return rng.randbytes(PAGE_SIZE)
+
+
+def make_exec_count(rng: random.Random) -> bytes:
+    count = array('I', bytes(PAGE_SIZE * 2))
+    for i in rng.sample(range(PAGE_SIZE // 2), PAGE_SIZE // 16):
+        count[i] = rng.randrange(1, 1 << 20)
+    return count.tobytes()
+
+
+def make_checkpoint(f: io.TextIOBase, dirname: str, name: str, kind: int,
+                    num_pages: int, density: float, rng: random.Random):
+    # a fifth of the pages are code, the rest heap; syscalls come from
+    # a few sites, and about half of them write memory
+    num_code = max(num_pages // 5, 4)
+    code_pns = list(range(FIRST_PN, FIRST_PN + num_code))
+    data_pns = list(range(HEAP_PN, HEAP_PN + num_pages - num_code))
+
+    def code_addr():
+        return rng.choice(code_pns) * PAGE_SIZE + rng.randrange(0, 4096, 4)
+
+    def data_addr(size):
+        return rng.choice(data_pns) * PAGE_SIZE + \
+            rng.randrange(PAGE_SIZE - min(size, PAGE_SIZE) + 1)
+
+    f.write('begin 0x%x\n' % code_addr())
+    for reg in ['ireg', 'freg']:
+        f.write(reg + ' %x' * 32 % tuple(
+            rng.getrandbits(64) for _ in range(32)) + '\n')
+    sites = [code_addr() for _ in range(32)]
+    retvals = []
+    for _ in range(max(int(num_pages * density), 1)):
+        retvals.append(rng.getrandbits(16))
+        line = 'syscall 0x%x %x' % (rng.choice(sites), retvals[-1])
+        if rng.random() < 0.5:
+            size = rng.choice([8, 64, 512, 4096])
+            line += ' 0x%x %s' % (data_addr(size), rng.randbytes(size).hex())
+        f.write(line + '\n')
+
+    # break at an ecall or the first instruction, or at a repeating
+    # instruction with or without the history of its executions, which
+    # rv-sim writes right before the break
+    addr = code_addr()
+    execs = sorted(rng.randrange(len(retvals) + 1)
+                   for _ in range(BREAK_REPEAT - 1))
+    if kind == 2:
+        f.write('history' + ''.join(' %d:%x' % (i, rng.getrandbits(64))
+                                    for i in execs) + '\n')
+    if kind < 2:
+        f.write('break 0x%x %s\n' % (addr, ['ecall', 'first'][kind]))
+    else:
+        f.write('break 0x%x repeat %d 15\n' % (addr, BREAK_REPEAT))
+    if kind == 3:
+        with open(os.path.join(dirname, name + '.trace'), 'wb') as trace:
+            for i, retval in enumerate(retvals + [None]):
+                while execs and execs[0] == i:
+                    execs.pop(0)
+                    trace.write(TRACE.pack(TRACE_EXECUTE, 0))
+                if retval is not None:
+                    trace.write(TRACE.pack(TRACE_SYSCALL, retval))
+            trace.write(TRACE.pack(TRACE_STOP, 0))
+
+    f.write('file %s.dump\n' % name)
+    with open(os.path.join(dirname, name + '.dump'), 'wb') as dump:
+        for pn in code_pns + data_pns:
+            f.write('page %x\n' % pn)
+            dump.write(make_bitmap(rng).to_bytes(PAGE_SIZE // 8, 'little'))
+            dump.write(make_data(rng, pn in code_pns))
+        for pn in code_pns:
+            f.write('exec %x\n' % pn)
+            dump.write(make_exec_count(rng))
+    for _ in range(16):
+        f.write('store 0x%x %016x\n' % (data_addr(8), rng.getrandbits(64)))
+
+
+def make_pipeline(dirname: str, num_ckpts: int, num_pages: int,
+                  density: float, seed: int) -> str:
+    rng = random.Random(seed)
+    logpath = os.path.join(dirname, 'bench.cpt')
+    with open(logpath, 'w') as f:
+        for i in range(num_ckpts):
+            make_checkpoint(f, dirname, 'checkpoint_%04d' % i, i % 4,
+                            num_pages, density, rng)
+
+    # the stand-ins
+    bindir = os.path.join(dirname, 'bin')
+    os.makedirs(bindir)
+    for name, script in [('make', FAKE_MAKE), ('rv-sim', FAKE_RV_SIM),
+                         ('spike', FAKE_SPIKE), ('cl', '')]:
+        with open(os.path.join(bindir, name), 'w') as f:
+            f.write(script)
+        os.chmod(os.path.join(bindir, name), 0o755)
+    return logpath
+
+
+def run_main(logpath: str, jobs: int, toolchain: bool) -> int:
+    # reprocess and verify all, quietly, returning the failures
+    summarypath = os.path.splitext(logpath)[0] + '.json'
+    options = parse.parser.parse_args([
+        logpath, '-r', '-v', '-j', str(jobs), '--cache-size', '0',
+        '--summary', summarypath])
+    MakeHelper.toolchain = toolchain
+    MakeHelper.memo = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            failed = parse.main(options)
+    finally:
+        MakeHelper.toolchain = False
+    with open(summarypath) as f:
+        return failed + json.load(f)['verify_failed']
+
+
+def digest_outputs(blocks: list) -> dict:
+    digests = {}
+    for block in blocks:
+        for path in block.header.outputs():
+            with open(path, 'rb') as f:
+                digests[path] = hashlib.sha256(f.read()).hexdigest()
+    return digests
+
+
+def bench_compress(blocks: list, key: str):
+    try:
+        import compress
+    except OSError:  # fastlz.so not built
+        print('  compress  skipped, fastlz.so not built')
+        return
+    model = compress.CostModel(compress.DEFAULT_MODEL)
+    for planner in ['threshold', 'cost']:
+        def run():
+            for block in blocks:
+                prefix = block.path_prefix + block.header.suffixes()[-1]
+                options = compress.parser.parse_args([
+                    '-j', '1', '--planner', planner,
+                    prefix + '.cfg', prefix + '.dump'])
+                compress.compress_image(
+                    prefix + '.cfg', prefix + '.dump', options, model)
+        t, _ = timeit(run)
+        print('  %-9s %8.3fs' % (planner, t))
+        RESULTS[key + 'compress.' + planner] = t
+
+
+def bench_pipeline(args):
+    old_path = os.environ['PATH']
+    for num_pages in map(int, args.scales.split(',')):
+        key = 'pipeline.%d.' % num_pages
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logpath = make_pipeline(tmpdir, args.checkpoints, num_pages,
+                                    args.syscalls, args.seed)
+            os.environ['PATH'] = os.path.join(tmpdir, 'bin') + ':' + old_path
+            parse.CL_PATH = os.path.join(tmpdir, 'bin', 'cl')
+            print('pipeline: %d checkpoints of %d pages' % (
+                args.checkpoints, num_pages))
+            try:
+                t, failed = timeit(run_main, logpath, args.jobs, False)
+                assert not failed, 'parse.main failed'
+                print('  main      %8.3fs' % t)
+                RESULTS[key + 'main'] = t
+
+                blocks = index_log(logpath, None)
+                if args.toolchain:
+                    digests = digest_outputs(blocks)
+                    t, failed = timeit(run_main, logpath, args.jobs, True)
+                    assert not failed, 'parse.main failed'
+                    print('  toolchain %8.3fs' % t)
+                    RESULTS[key + 'main.toolchain'] = t
+                    assert digest_outputs(blocks) == digests, \
+                        'outputs of make and Encoder differ'
+
+                # stages, in this process
+                t, ckpts = timeit(lambda: [b.load() for b in blocks])
+                print('  load      %8.3fs' % t)
+                RESULTS[key + 'load'] = t
+                t, _ = timeit(lambda: [c.pages.make_free_list()
+                                       for c in ckpts])
+                print('  freelist  %8.3fs' % t)
+                RESULTS[key + 'make_free_list'] = t
+                t, _ = timeit(lambda: [c.pages.snapshot() for c in ckpts])
+                print('  snapshot  %8.3fs' % t)
+                RESULTS[key + 'snapshot'] = t
+
+                def dump():
+                    for ckpt in ckpts:
+                        with open(os.path.join(tmpdir, 'tmp.dump'),
+                                  'wb') as f:
+                            ckpt.pages.dump(f, io.StringIO())
+                t, _ = timeit(dump)
+                print('  dump      %8.3fs' % t)
+                RESULTS[key + 'dump'] = t
+
+                if np is not None:
+                    bbv = make_bbv_base(max(num_pages // 5, 4), args.seed)
+                    t, _ = timeit(lambda: [c.pages.dump_bbv(
+                        bbv, io.StringIO()) for c in ckpts])
+                    print('  dump_bbv  %8.3fs' % t)
+                    RESULTS[key + 'dump_bbv'] = t
+
+                def process_once():
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        for ckpt in ckpts:
+                            ckpt.process_once(suffix='.bench')
+                t, _ = timeit(process_once)
+                print('  process   %8.3fs' % t)
+                RESULTS[key + 'process_once'] = t
+
+                bench_compress(blocks, key)
+            finally:
+                os.environ['PATH'] = old_path
+                parse.CL_PATH = os.path.join(SRC_DIR, 'cl')
+
+
+def save_results(path: str, args):
+    with open(path, 'w') as f:
+        json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'host': platform.node(),
+                   'python': platform.python_version(),
+                   'args': vars(args), 'results': RESULTS}, f, indent=1)
+    print('results saved to %s' % path)
+
+
+def compare_results(path: str):
+    with open(path) as f:
+        saved = json.load(f)
+    print('compared with %s of %s:' % (path, saved['time']))
+    print('  %-36s %9s %9s %8s' % ('', 'saved', 'now', 'speedup'))
+    for name, t in RESULTS.items():
+        old = saved['results'].get(name)
+        if old is not None:
+            print('  %-36s %8.3fs %8.3fs %7.2fx' % (name, old, t, old / t))
+
+
+BENCHES = {
+    'freelist': bench_freelist,
+    'reserve': bench_reserve,
+    'bbv': bench_bbv,
+    'parse': bench_parse,
+    'pipeline': bench_pipeline,
+}
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    for name in args.bench or BENCHES:
+        BENCHES[name](args)
+    if args.save:
+        save_results(args.save, args)
+    if args.compare:
+        compare_results(args.compare)
@@ -8,7 +8,25 @@ void map_pages(void *mc_p, int mc_num, int md_fd)
 
     for (int i = 0; i < mc_num; i++) {
         mmap_cfg *mc_i = (mmap_cfg *)mc_p + i;
-        if (mc_i->size == mc_i->length) {
+        if (mc_i->length == CL_FILL) {
+            void *addr = (void *)mc_i->addr;
+            addr = raw_mmap(addr, mc_i->size,
+                            PROT_EXEC | PROT_READ | PROT_WRITE,
+                            MAP_PRIVATE | MAP_ANONYMOUS | MAP_FIXED,
+                            -1, 0);
+            if ((long)addr < 0) {
+                RAW_PANIC("mmap anonymous failed");
+            }
+            // the offset holds the fill byte; write every word, or
+            // one per page for zero, which also allocates the pages
+            // before execution as below
+            uint64_t word = (mc_i->offset & 0xff) * 0x0101010101010101ULL;
+            uint64_t step = word ? sizeof(word) : 4096;
+            for (uint64_t i = 0; i < mc_i->size; i += step) {
+                volatile uint64_t *p = addr + i;
+                *p = word;
+            }
+        } else if (mc_i->size == mc_i->length) {
             void *addr = (void *)mc_i->addr;
             addr = raw_mmap(addr, mc_i->size,
                             PROT_EXEC | PROT_READ | PROT_WRITE,
@@ -3,6 +3,8 @@
 #include <stdint.h>
 #include <stddef.h>
 
+// a length of CL_FILL maps pages filled with the byte in offset,
+// which take no space in the dump
 typedef struct {
     uint64_t addr;
     uint64_t offset;
@@ -10,6 +12,8 @@ typedef struct {
     uint32_t length;
 } mmap_cfg;
 
+#define CL_FILL 0
+
 #define CL_BASE 0x60000000
 #define CL_TOP 0x80000000
 #define CL_STACK_SIZE 4096
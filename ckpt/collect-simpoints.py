@@ -1,29 +1,148 @@
 import os
+import fcntl
 import shutil
 import argparse
-from subprocess import Popen, DEVNULL
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import parse
+from parse import PageStore, StubCache, Verifier
 
 parser = argparse.ArgumentParser()
 parser.add_argument('path')
 parser.add_argument('-c', '--compress', action='store_true')
 parser.add_argument('-d', '--output-dir', default='simpoints')
 parser.add_argument('-v', '--verify', action='store_true')
+parser.add_argument('--verify-timeout', type=float, default=3600,
+                    help='seconds before killing a spike run, 0 for none')
+parser.add_argument('--verify-insns', type=int,
+                    help='instructions before stopping a spike run')
+parser.add_argument('--cache-dir', default=parse.parser.get_default(
+    'cache_dir'), help='where verifications are cached with parse.py')
+parser.add_argument('-s', '--store',
+                    help='expand checkpoints from this page store of parse.py')
+parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+parser.add_argument('--copy', action='store_true',
+                    help='never hardlink the picked checkpoints')
+parser.add_argument('-k', '--max-k', type=int,
+                    help='pick simpoints from the .bb files by clustering '
+                    'into at most this many clusters, instead of stdin')
+parser.add_argument('--dim', type=int, default=15,
+                    help='dimensions to project the bbvs to')
+parser.add_argument('--seeds', type=int, default=5,
+                    help='k-means runs for each k')
+parser.add_argument('--bic-threshold', type=float, default=0.9)
+parser.add_argument('--seed', type=int, default=0)
+# passed on to compress.py, whose defaults apply when not given
+parser.add_argument('--planner', choices=['cost', 'threshold'],
+                    help='planner of compress.py')
+parser.add_argument('-r', '--max-ratio', type=float,
+                    help='--max-ratio of compress.py')
+parser.add_argument('-l', '--max-length', type=int,
+                    help='--max-length of compress.py')
+parser.add_argument('-p', '--max-pages', type=int,
+                    help='--max-pages of compress.py')
+parser.add_argument('--model', help='--model of compress.py')
 
 srcdir = os.path.dirname(os.path.abspath(__file__))
-comppath = os.path.join(srcdir, 'compress.py')
 clpath = os.path.join(srcdir, 'cl')
 
+FICLONE = 0x40049409  # ioctl of linux/fs.h
+
+
+def link_file(src: str, dst: str, hardlink: bool = True):
+    # make dst the same as src as cheaply as the file system allows;
+    # a hardlink is safe since parse.py replaces its outputs instead
+    # of writing them in place
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:  # e.g. across file systems
+            pass
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:  # no reflinks
+            pass
+        # copy within the kernel, or by hand from where it stopped
+        size = os.fstat(fsrc.fileno()).st_size
+        offs = 0
+        try:
+            while offs < size:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                       size - offs)
+                if not n:
+                    break
+                offs += n
+        except OSError:
+            pass
+        fsrc.seek(offs)
+        fdst.seek(offs)
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def compress_options(args) -> list:
+    # the options of compress.py given to this script
+    options = ['-j', '1']
+    for name in ['planner', 'max_ratio', 'max_length', 'max_pages', 'model']:
+        value = getattr(args, name)
+        if value is not None:
+            options += ['--' + name.replace('_', '-'), str(value)]
+    return options
+
+
+def collect(args, store: PageStore, model, name: str) -> str:
+    # copy or compress a picked checkpoint into the output dir, in
+    # a worker started from main; model is the cost model when
+    # compressing
+    def output_path(name):
+        return os.path.join(args.output_dir, name)
+
+    if not args.compress:
+        link_file(name + '.cfg', output_path(name + '.cfg'), not args.copy)
+        if store is None:
+            link_file(name + '.dump', output_path(name + '.dump'),
+                      not args.copy)
+        else:
+            store.export(name + '.pages', output_path(name + '.dump'))
+        return name
+
+    dump = name + '.dump'
+    if store is not None:
+        # compress a copy expanded next to the outputs
+        dump = output_path(name + '.dump')
+        store.export(name + '.pages', dump)
+    import compress
+    options = compress.parser.parse_args(
+        compress_options(args) + [name + '.cfg', dump])
+    result = compress.compress_image(
+        name + '.cfg', dump, options, model,
+        output_path(name + '.c.cfg'), output_path(name + '.c.dump'))
+    if store is not None:
+        os.unlink(dump)
+    print('%s: %d/%d pages compressed, expected load time %.3fms' % (
+        name, result['comp_pages'], result['pages'],
+        result['load_cost'] / 1e6))
+    return name + '.c'
+
+
 if __name__ == '__main__':
     args = parser.parse_args()
+    args.cache_dir = os.path.abspath(args.cache_dir)
     destdir = os.path.dirname(args.path)
     logname = os.path.basename(args.path)
     if destdir:
         os.chdir(destdir)
     os.makedirs(args.output_dir, exist_ok=True)
 
-    def output_path(name):
-        return os.path.join(args.output_dir, name)
-
     print('reading log')
     dump_names = []
     with open(logname) as f:
@@ -37,14 +156,34 @@ if __name__ == '__main__':
                 dump_names.append(name)
 
     print('found %d checkpoints' % len(dump_names))
-    print('input simpoints (end with an empty line):')
     simpoints = []
-    while True:
-        line = input()
-        if not line:
-            break
-        i, _ = line.split()
-        simpoints.append(int(i))
+    if args.max_k:
+        print('clustering')
+        import simpoint  # only now, as it needs numpy
+        result = simpoint.simpoints(
+            [name + '.bb' for name in dump_names], args.max_k, args.dim,
+            args.seeds, bic_threshold=args.bic_threshold, seed=args.seed,
+            jobs=args.jobs)
+        # saved as by SimPoint, for estimating the IPC
+        with open(os.path.join(args.output_dir, 'simpoints.txt'), 'w') as f:
+            for i, cluster, _ in result:
+                f.write('%d %d\n' % (i, cluster))
+        with open(os.path.join(args.output_dir, 'weights.txt'), 'w') as f:
+            for _, cluster, weight in result:
+                f.write('%f %d\n' % (weight, cluster))
+        for i, cluster, weight in result:
+            print('%d %d %f' % (i, cluster, weight))
+        simpoints = [i for i, _, _ in result]
+    else:
+        print('input simpoints (end with an empty line):')
+        while True:
+            line = input()
+            if not line:
+                break
+            i, _ = line.split()
+            simpoints.append(int(i))
+
+    store = PageStore(args.store) if args.store else None
 
     picked_names = []
     for i in simpoints:
@@ -54,20 +193,21 @@ if __name__ == '__main__':
         else:
             picked_names.append(name + '.1')
 
+    # compressing is mostly python, so it takes processes, while
+    # copying mostly waits for the kernel
     if args.compress:
         print('compressing')
-        for name in picked_names:
-            cmd = ['python3', comppath, name + '.cfg', name + '.dump']
-            p = Popen(cmd, stdout=DEVNULL)
-            if p.wait():
-                exit(p.returncode)
-            os.rename(name + '.c.cfg', output_path(name + '.c.cfg'))
-            os.rename(name + '.c.dump', output_path(name + '.c.dump'))
-        picked_names = list(map(lambda s: s + '.c', picked_names))
+        import compress  # only now, as it loads fastlz.so
+        model = compress.CostModel.load(args.model or compress.MODEL_PATH)
+        pool = ProcessPoolExecutor(
+            args.jobs, mp_context=multiprocessing.get_context('fork'))
     else:
-        for name in picked_names:
-            shutil.copy(name + '.cfg', output_path(name + '.cfg'))
-            shutil.copy(name + '.dump', output_path(name + '.dump'))
+        print('copying')
+        model = None
+        pool = ThreadPoolExecutor(args.jobs)
+    with pool:
+        picked_names = list(pool.map(
+            functools.partial(collect, args, store, model), picked_names))
 
     print('generating run script')
     os.chdir(args.output_dir)
@@ -80,11 +220,12 @@ if __name__ == '__main__':
 
     if args.verify:
         print('verifying')
-        nstr = str(len(picked_names))
-        for i, name in enumerate(picked_names, 1):
-            print('\r%*d/%s' % (len(nstr), i, nstr), end='')
-            cmd = ['spike', 'pk', clpath, name + '.cfg', name + '.dump']
-            p = Popen(cmd, stdout=DEVNULL)
-            if p.wait():
-                print('\nspike returned %d: %s' % (p.returncode, name))
-        print()
+        cache = StubCache(os.path.join(args.cache_dir, 'verify'),
+                          parse.parser.get_default('cache_size') << 20)
+        verifier = Verifier(clpath, args.jobs, args.verify_timeout,
+                            args.verify_insns, cache)
+        results = verifier.verify_all(
+            [(name, name + '.cfg', name + '.dump') for name in picked_names])
+        cache.trim()
+        print('%d/%d verified' % (sum(r['passed'] for r in results),
+                                  len(results)))
@@ -1,7 +1,13 @@
 import os
 import math
+import json
+import time
+import mmap
 import ctypes
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
 
 dirname = os.path.dirname(__file__)
 dirname = dirname if dirname else '.'
@@ -10,13 +16,64 @@ lib = ctypes.CDLL(libpath)
 fastlz_compress_level = lib.fastlz_compress_level
 fastlz_decompress = lib.fastlz_decompress
 
+PAGE_SIZE = 4096
+LEVELS = [1, 2]  # of FastLZ, fastlz_decompress in cl takes either
+
+# estimated load time of a checkpoint, in ns, roughly for a 100MHz
+# soft core whose file reads go through the host; --calibrate
+# measures this host instead, and the model file may be edited
+DEFAULT_MODEL = {
+    'record_ns': 50000,  # per cfg record, i.e. an mmap plus a read
+    'read_ns_per_byte': 200,  # of the dump
+    'decompress_ns_per_byte': {'1': 40, '2': 50},  # of the output
+}
+MODEL_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'rv8-ckpt', 'compress-model.json')
+
+
+class Compressor:
+    '''
+    FastLZ with an output buffer per thread, grown to the largest
+    input seen so far instead of allocated per call. The ctypes call
+    releases the GIL, so threads compress in parallel.
+    '''
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def buffer(self, size: int) -> ctypes.Array:
+        buf = getattr(self.local, 'buf', None)
+        if buf is None or len(buf) < size:
+            buf = ctypes.create_string_buffer(size)
+            self.local.buf = buf
+        return buf
+
+    def compress_at(self, addr: int, length: int, level: int = 2) -> bytes:
+        # compress length bytes at addr, which lets runs be compressed
+        # in place out of a joined segment
+        assert length >= 16
+        output = self.buffer(max(66, math.ceil(length * 1.05)))
+        outlen = fastlz_compress_level(
+            level, ctypes.c_void_p(addr), length, output)
+        return ctypes.string_at(output, outlen)
+
+    def compress(self, input: bytes) -> bytes:
+        return self.compress_at(address_of(input), len(input))
+
+    def compress_all(self, inputs: List[bytes]) -> List[bytes]:
+        return [self.compress(input) for input in inputs]
+
+
+def address_of(input: bytes) -> int:
+    return ctypes.cast(input, ctypes.c_void_p).value
+
+
+engine = Compressor()
+
 
 def compress(input: bytes) -> bytes:
-    assert len(input) >= 16
-    outlen = max(66, math.ceil(len(input) * 1.05))
-    output = ctypes.create_string_buffer(outlen)
-    outlen = fastlz_compress_level(2, input, len(input), output)
-    return output.raw[:outlen]
+    return engine.compress(input)
 
 
 def decompress(input: bytes, maxout: int) -> bytes:
@@ -27,20 +84,313 @@ def decompress(input: bytes, maxout: int) -> bytes:
     return output.raw[:outlen]
 
 
+class CostModel:
+    '''
+    Estimated time for cl to load a checkpoint. Each record of the
+    cfg costs a fixed overhead, each byte of the dump the time to read
+    it, and compressed records also the time to decompress each byte
+    of their output.
+    '''
+
+    def __init__(self, model: dict):
+        self.model = model
+        self.record = model['record_ns']
+        self.read = model['read_ns_per_byte']
+        self.decompress = {int(level): ns for level, ns in
+                           model['decompress_ns_per_byte'].items()}
+
+    @staticmethod
+    def load(path: str) -> 'CostModel':
+        try:
+            with open(path) as f:
+                return CostModel(json.load(f))
+        except FileNotFoundError:
+            return CostModel(DEFAULT_MODEL)
+
+    def save(self, path: str):
+        # through a private file, so that concurrent loads never see a
+        # partial model
+        dirname, basename = os.path.split(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+        tmppath = os.path.join(dirname, '.%s.%d' % (basename, os.getpid()))
+        try:
+            with open(tmppath, 'w') as f:
+                json.dump(self.model, f, indent=1)
+            os.replace(tmppath, path)
+        except BaseException:
+            if os.path.exists(tmppath):
+                os.unlink(tmppath)
+            raise
+
+    def cost(self, size: int, length: int, level: int) -> float:
+        # level 0 for uncompressed records
+        cost = self.record + self.read * length
+        if level:
+            cost += self.decompress[level] * size
+        return cost
+
+
+def time_per_call(func, *args) -> float:
+    # in ns, repeating until the total is long enough to measure
+    calls = 0
+    begin = time.perf_counter()
+    while True:
+        func(*args)
+        calls += 1
+        elapsed = time.perf_counter() - begin
+        if elapsed > 0.1:
+            return elapsed * 1e9 / calls
+
+
+def calibrate(pages: List[bytes], dumppath: str,
+              max_length: int) -> CostModel:
+    # measure loading on this host with the pages of the checkpoint
+    def map_record():
+        m = mmap.mmap(-1, PAGE_SIZE)
+        m[0] = 1
+        m.close()
+    record = time_per_call(map_record)
+
+    fd = os.open(dumppath, os.O_RDONLY)
+    size = max(os.fstat(fd).st_size, 1)
+    read = time_per_call(os.pread, fd, size, 0) / size
+    os.close(fd)
+
+    samples = [data for data in pages
+               if len(engine.compress(data)) <= max_length][:256]
+    if not samples:
+        samples = [bytes(range(256)) * (PAGE_SIZE // 256)]
+    output = ctypes.create_string_buffer(PAGE_SIZE)
+
+    def decompress_all(inputs):
+        for input in inputs:
+            fastlz_decompress(input, len(input), output, PAGE_SIZE)
+    decomp = {}
+    for level in LEVELS:
+        inputs = [engine.compress_at(address_of(data), PAGE_SIZE, level)
+                  for data in samples]
+        ns = time_per_call(decompress_all, inputs)
+        decomp[str(level)] = ns / (len(samples) * PAGE_SIZE)
+
+    return CostModel({'record_ns': record, 'read_ns_per_byte': read,
+                      'decompress_ns_per_byte': decomp})
+
+
+def compress_pages(pool: ThreadPoolExecutor, jobs: int,
+                   pages: List[bytes]) -> List[bytes]:
+    if jobs == 1:
+        return engine.compress_all(pages)
+    # batch pages so that each task outweighs its scheduling
+    batch = max(1, min(256, math.ceil(len(pages) / (jobs * 4))))
+    batches = [pages[i:i + batch] for i in range(0, len(pages), batch)]
+    result = []
+    for comp_data in pool.map(engine.compress_all, batches):
+        result += comp_data
+    return result
+
+
+def coalesce(pool: ThreadPoolExecutor, jobs: int, addr: int,
+             pages: List[bytes], comp_pages: List[bytes],
+             max_length: int) -> List[Tuple[int, int, bytes]]:
+    '''
+    Split a segment of contiguous compressible pages into runs, each
+    growing a page at a time while the whole run compresses within
+    max_length. Returns (addr, num_pages, comp_data) of each run.
+    '''
+    # FastLZ is not incremental, so every extension still compresses
+    # the whole run, but the result is kept for output, and the next
+    # few extensions are tried in parallel
+    data = b''.join(pages)
+    base = address_of(data)
+    runs = []
+    i = 0
+    while i < len(pages):
+        j = i + 1
+        run_data = comp_pages[i]
+        while j < len(pages):
+            ends = range(j + 1, min(j + jobs, len(pages)) + 1)
+            begin = base + i * PAGE_SIZE
+            lengths = [(end - i) * PAGE_SIZE for end in ends]
+            results = (pool.map if jobs > 1 else map)(
+                engine.compress_at, [begin] * len(lengths), lengths)
+            for comp_data in results:
+                if len(comp_data) > max_length:
+                    break
+                run_data = comp_data
+                j += 1
+            else:
+                continue
+            break
+        runs.append((addr + i * PAGE_SIZE, j - i, run_data))
+        i = j
+    return runs
+
+
+def split_segments(page_list: List[Tuple[int, bytes]]) -> List[tuple]:
+    # (addr, [data, ...]) of each range of contiguous pages
+    segments = []
+    for addr, data in page_list:
+        if segments and \
+                segments[-1][0] + len(segments[-1][1]) * PAGE_SIZE == addr:
+            segments[-1][1].append(data)
+        else:
+            segments.append((addr, [data]))
+    return segments
+
+
+def plan_threshold(pool: ThreadPoolExecutor, args,
+                   page_list: List[Tuple[int, bytes]]) -> List[tuple]:
+    '''
+    Compresses the pages that each compress within max_ratio,
+    coalesced while the run compresses within max_length, and leaves
+    the others uncompressed. Returns (addr, num_pages, level, data) of
+    each record, where data is the pages of uncompressed records.
+    '''
+    comp_list = compress_pages(pool, args.jobs,
+                               [data for _, data in page_list])
+
+    # group pages into segments of contiguous pages; compressed pages
+    # may be coalesced if each page fits into the min compression ratio
+    # and the total length is within the max length
+    comp = []  # addr, [data, ...], [comp_data, ...]
+    uncomp = []  # addr, [data, ...]
+    for (addr, data), comp_data in zip(page_list, comp_list):
+        if len(comp_data) <= len(data) * args.max_ratio:
+            if not comp:
+                comp.append((addr, [data], [comp_data]))
+            elif comp[-1][0] + len(comp[-1][1]) * PAGE_SIZE < addr:
+                comp.append((addr, [data], [comp_data]))
+            else:
+                comp[-1][1].append(data)
+                comp[-1][2].append(comp_data)
+        # uncompressed pages can be freely coalesced
+        else:
+            if not uncomp:
+                uncomp.append((addr, [data]))
+            elif uncomp[-1][0] + len(uncomp[-1][1]) * PAGE_SIZE < addr:
+                uncomp.append((addr, [data]))
+            else:
+                uncomp[-1][1].append(data)
+
+    records = [(addr, len(data), 0, data) for addr, data in uncomp]
+    for addr, data, comp_data in comp:
+        runs = coalesce(pool, args.jobs, addr, data, comp_data,
+                        args.max_length)
+        records += [(addr, num_pages, 2, comp_data)
+                    for addr, num_pages, comp_data in runs]
+    return records
+
+
+def plan_cost(pool: ThreadPoolExecutor, args, model: CostModel,
+              page_list: List[Tuple[int, bytes]]) -> List[tuple]:
+    '''
+    Splits each segment of contiguous pages into records, either
+    uncompressed or compressed by one of the FastLZ levels, that
+    minimize the load time estimated by the model. Returns the same
+    as plan_threshold.
+    '''
+    segments = split_segments(page_list)
+    joined = [b''.join(data) for _, data in segments]
+    mapper = pool.map if args.jobs > 1 else map
+
+    # compressed lengths of the runs from a page, up to max_pages and
+    # until one is too long for the buffer of cl
+    def try_runs(seg: int, i: int) -> List[Tuple[int, int, int]]:
+        base = address_of(joined[seg]) + i * PAGE_SIZE
+        end = min(i + args.max_pages, len(segments[seg][1]))
+        runs = []  # (end, level, length)
+        for level in LEVELS:
+            for j in range(i + 1, end + 1):
+                length = len(engine.compress_at(
+                    base, (j - i) * PAGE_SIZE, level))
+                if length > args.max_length:
+                    break
+                runs.append((j, level, length))
+        return runs
+
+    starts = [(seg, i) for seg, (_, data) in enumerate(segments)
+              for i in range(len(data))]
+    tried = mapper(try_runs, [seg for seg, _ in starts],
+                   [i for _, i in starts])
+    ends = [[[] for _ in range(len(data) + 1)] for _, data in segments]
+    for (seg, i), runs in zip(starts, tried):
+        for j, level, length in runs:
+            ends[seg][j].append((i, level, length))
+
+    records = []
+    comp_runs = []  # (seg, begin, end, level)
+    page_read = model.read * PAGE_SIZE
+    for seg, (addr, data) in enumerate(segments):
+        # best[j] is the min cost of the first j pages, and open_cost
+        # the same with the j-th page in an uncompressed record, which
+        # the next page may extend
+        best = [0.0] + [math.inf] * len(data)
+        choice = [None] * len(best)  # (begin, level) of the last record
+        open_cost, open_begin = math.inf, 0
+        for j in range(1, len(best)):
+            if best[j - 1] + model.record < open_cost:
+                open_cost, open_begin = best[j - 1] + model.record, j - 1
+            open_cost += page_read
+            best[j], choice[j] = open_cost, (open_begin, 0)
+            for i, level, length in ends[seg][j]:
+                cost = best[i] + model.cost(
+                    (j - i) * PAGE_SIZE, length, level)
+                if cost < best[j]:
+                    best[j], choice[j] = cost, (i, level)
+
+        j = len(data)
+        while j > 0:
+            i, level = choice[j]
+            if level:
+                comp_runs.append((seg, i, j, level))
+            else:
+                records.append((addr + i * PAGE_SIZE, j - i, 0, data[i:j]))
+            j = i
+
+    # only lengths were kept, so compress the chosen runs again
+    def compress_run(seg: int, i: int, j: int, level: int) -> bytes:
+        base = address_of(joined[seg]) + i * PAGE_SIZE
+        return engine.compress_at(base, (j - i) * PAGE_SIZE, level)
+
+    comp_list = mapper(compress_run, *map(list, zip(*comp_runs))) \
+        if comp_runs else []
+    for (seg, i, j, level), comp_data in zip(comp_runs, comp_list):
+        addr = segments[seg][0] + i * PAGE_SIZE
+        records.append((addr, j - i, level, comp_data))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument('cfg')
 parser.add_argument('dump')
-parser.add_argument('-r', '--max-ratio', type=float, default=0.3)
-parser.add_argument('-l', '--max-length', type=int, default=2048)
+parser.add_argument('-r', '--max-ratio', type=float, default=0.3,
+                    help='max compression ratio of each compressed page, '
+                    'for the threshold planner')
+parser.add_argument('-l', '--max-length', type=int, default=2048,
+                    help='max length of a compressed record, at most '
+                    'CL_BUF_SIZE of cl')
+parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+parser.add_argument('--planner', choices=['cost', 'threshold'],
+                    default='threshold',
+                    help='minimize the load time estimated by the model, '
+                    'or compress pages by --max-ratio')
+parser.add_argument('-p', '--max-pages', type=int, default=16,
+                    help='max pages of a compressed record, for the cost '
+                    'planner')
+parser.add_argument('--model', default=MODEL_PATH,
+                    help='json of the load cost model (default: %(default)s)')
+parser.add_argument('--calibrate', action='store_true',
+                    help='measure the model on this host and save it')
 
-if __name__ == '__main__':
-    args = parser.parse_args()
 
-    # read image
-    cfgfile = open(args.cfg)
-    dumpfile = open(args.dump, 'rb')
+def read_image(cfgpath: str, dumppath: str) -> tuple:
+    # returns ({addr: page}, [(addr, fill, size)], mc_num, entry_pc)
+    cfgfile = open(cfgpath)
+    dumpfile = open(dumppath, 'rb')
 
     page_map = {}
+    fills = []
 
     mc_num = int(cfgfile.readline())
     for _ in range(mc_num):
@@ -50,6 +400,10 @@ if __name__ == '__main__':
         offset = int(tokens[1], 16)
         size = int(tokens[2], 16)
         length = int(tokens[3], 16)
+        # fill pages take no space, so they are kept as is
+        if length == 0:
+            fills.append((addr, offset, size))
+            continue
         assert size == length, 'Expected uncompressed data'
 
         dumpfile.seek(offset)
@@ -57,67 +411,98 @@ if __name__ == '__main__':
         assert len(data) == length, 'Unexpected EOF'
 
         # split dump into single pages
-        for off in range(0, size, 4096):
-            page_map[addr + off] = data[off:off + 4096]
+        for off in range(0, size, PAGE_SIZE):
+            page_map[addr + off] = data[off:off + PAGE_SIZE]
 
     entry_pc = int(cfgfile.readline(), 16)
     cfgfile.close()
     dumpfile.close()
+    return page_map, fills, mc_num, entry_pc
 
-    # try compressing data
-    comp = []  # addr, [data, ...]
-    uncomp = []  # addr, [data, ...]
-    comp_pages = 0
-    for addr, data in sorted(page_map.items()):
-        comp_data = compress(data)
-        # compressed pages may be coalesced if each page fits
-        # into the min compression ratio and the total length
-        # is within the max length
-        if len(comp_data) <= len(data) * args.max_ratio:
-            if not comp:
-                comp.append((addr, [data]))
-            elif comp[-1][0] + len(comp[-1][1]) * 4096 < addr:
-                comp.append((addr, [data]))
-            elif len(compress(b''.join(comp[-1][1]) + data)) > args.max_length:
-                comp.append((addr, [data]))
-            else:
-                comp[-1][1].append(data)
-            comp_pages += 1
-        # uncompressed pages can be freely coalesced
-        else:
-            if not uncomp:
-                uncomp.append((addr, [data]))
-            elif uncomp[-1][0] + len(uncomp[-1][1]) * 4096 < addr:
-                uncomp.append((addr, [data]))
-            else:
-                uncomp[-1][1].append(data)
 
-    # dump processed image
-    cfgfile = open('.c'.join(os.path.splitext(args.cfg)), 'w')
-    dumpfile = open('.c'.join(os.path.splitext(args.dump)), 'wb')
+def compress_image(cfgpath: str, dumppath: str, args,
+                   model: CostModel, outcfg: str = None,
+                   outdump: str = None) -> dict:
+    '''
+    Compresses a checkpoint into outcfg and outdump, by default named
+    with a .c suffix next to the input, with the options of parser.
+    Returns the numbers for report().
+    '''
+    page_map, fills, mc_num, entry_pc = read_image(cfgpath, dumppath)
+
+    pool = ThreadPoolExecutor(args.jobs)
+    page_list = sorted(page_map.items())
+    if args.planner == 'cost':
+        records = plan_cost(pool, args, model, page_list)
+    else:
+        records = plan_threshold(pool, args, page_list)
+    pool.shutdown()
+
+    # dump processed image, with uncompressed pages first since they
+    # need to be page-aligned
+    records.sort(key=lambda record: record[2] != 0)
+    cfgfile = open(outcfg or '.c'.join(os.path.splitext(cfgpath)), 'w')
+    dumpfile = open(outdump or '.c'.join(os.path.splitext(dumppath)), 'wb')
     offset = 0
-    cfgfile.write('%d\n' % (len(comp) + len(uncomp)))
-
-    # dump uncompressed pages first since they need to be
-    # page-aligned
-    for addr, data in uncomp:
-        size = len(data) * 4096
-        cfgfile.write('%x\t%x\t%x\t%x\n' % (addr, offset, size, size))
-        dumpfile.write(b''.join(data))
-        offset += size
-
-    for addr, data in comp:
-        size = len(data) * 4096
-        comp_data = compress(b''.join(data))
-        length = len(comp_data)
+    cfgfile.write('%d\n' % (len(records) + len(fills)))
+
+    comp_pages = 0
+    load_cost = model.record * len(fills)
+    num_records = {level: 0 for level in [0] + LEVELS}
+    for addr, num_pages, level, data in records:
+        size = num_pages * PAGE_SIZE
+        if level:
+            length = len(data)
+            dumpfile.write(data)
+            comp_pages += num_pages
+        else:
+            length = size
+            dumpfile.writelines(data)
         cfgfile.write('%x\t%x\t%x\t%x\n' % (addr, offset, size, length))
-        dumpfile.write(comp_data)
         offset += length
+        load_cost += model.cost(size, length, level)
+        num_records[level] += 1
+
+    for addr, fill, size in fills:
+        cfgfile.write('%x\t%x\t%x\t%x\n' % (addr, fill, size, 0))
 
     cfgfile.write('%x\n' % entry_pc)
     cfgfile.close()
     dumpfile.close()
 
-    print('compressed pages: %d/%d' % (comp_pages, len(page_map)))
-    comp_ratio = 1 - offset / (len(page_map) * 4096)
+    input_cost = model.record * mc_num + \
+        model.read * len(page_map) * PAGE_SIZE
+    return {'comp_pages': comp_pages, 'pages': len(page_map),
+            'length': offset, 'records': num_records,
+            'fills': len(fills), 'load_cost': load_cost,
+            'input_cost': input_cost}
+
+
+def report(result: dict):
+    print('compressed pages: %d/%d' % (result['comp_pages'], result['pages']))
+    comp_ratio = 1 - result['length'] / (result['pages'] * PAGE_SIZE)
     print('compression ratio: %.1f%%' % (comp_ratio * 100))
+
+    # report the load time against that of the input
+    num_records = result['records']
+    print('records: %d uncompressed, %s, %d fill' % (
+        num_records[0], ', '.join('%d level %d' % (num_records[level], level)
+                                  for level in LEVELS), result['fills']))
+    print('expected load time: %.3fms, %.3fms as is' % (
+        result['load_cost'] / 1e6, result['input_cost'] / 1e6))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    assert args.jobs > 0, 'Expected at least one job'
+
+    if args.calibrate:
+        page_map, _, _, _ = read_image(args.cfg, args.dump)
+        model = calibrate(list(page_map.values()), args.dump,
+                          args.max_length)
+        model.save(args.model)
+        print('model saved to %s' % args.model)
+    else:
+        model = CostModel.load(args.model)
+
+    report(compress_image(args.cfg, args.dump, args, model))
@@ -1,35 +1,503 @@
 import os
 import io
 import re
-import copy
+import sys
+import mmap
+import struct
+import bisect
 import argparse
 import hashlib
-from subprocess import Popen, PIPE, DEVNULL
+import fcntl
+import shutil
+import heapq
+import json
+import time
+import signal
+import resource
+import traceback
+import threading
+import contextlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired
 from typing import Union, List, Tuple
 
+try:
+    import numpy as np
+except ImportError:  # only required by BBVBase
+    np = None
+
 parser = argparse.ArgumentParser()
-parser.add_argument('path')
+parser.add_argument('path', nargs='?')
 parser.add_argument('--exec')
 parser.add_argument('-j', '--jobs', type=int, default=1)
 parser.add_argument('-r', '--rebuild', action='store_true')
+parser.add_argument('--retries', type=int, default=1,
+                    help='times to retry a failed checkpoint')
+parser.add_argument('--summary',
+                    help='write results as json here (default: <log>.json)')
 parser.add_argument('-v', '--verify', action='store_true')
+parser.add_argument('--verify-jobs', type=int,
+                    help='spike runs at once (default: --jobs)')
+parser.add_argument('--verify-timeout', type=float, default=3600,
+                    help='seconds before killing a spike run, 0 for none')
+parser.add_argument('--verify-insns', type=int,
+                    help='instructions before stopping a spike run')
+parser.add_argument('--cache-dir', default=os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'rv8-ckpt'))
+parser.add_argument('--cache-size', type=int, default=64,
+                    help='max size in MiB of the caches of verifications '
+                    'and of stubs built with the toolchain')
+parser.add_argument('--check-encoder', action='store_true',
+                    help='compare Encoder against the toolchain and exit')
+parser.add_argument('--check-decoder', action='store_true',
+                    help='compare the cfis decoded from --exec against '
+                    'objdump and exit')
+parser.add_argument('--convert', metavar='OUT',
+                    help='convert the text log to a binary log and exit')
+parser.add_argument('--store', metavar='DIR',
+                    help='keep pages in a page store shared by checkpoints, '
+                    'writing .pages instead of .dump')
+parser.add_argument('--profile', nargs='?', const='', metavar='TRACE',
+                    help='write a chrome trace of the stages of each '
+                    'checkpoint here (default: <log>.trace.json)')
+parser.add_argument('--export', metavar='DIR',
+                    help='write standalone .cfg and .dump of the outputs '
+                    'in --store to this directory and exit')
 
 SRC_DIR = os.path.dirname(__file__)
-WORK_DIR = os.getcwd()
+CL_PATH = os.path.join(SRC_DIR, 'cl')  # run by rv-sim and spike
 
 PAGE_OFFS = 12
 PAGE_SIZE = 1 << PAGE_OFFS
 PAGE_OFFS_MASK = PAGE_SIZE - 1
+PAGE_MASK = (1 << PAGE_SIZE) - 1  # bitmap of a full page
+ZERO_PAGE = bytes(PAGE_SIZE)
 FIRST_PN = 0x10
 ECALL = '00000073'
 J_MAX_OFFS = 1 << 20
 
+# binary log, see CheckpointManager in src/util/fmt.h
+LOG_MAGIC = b'RV8CKPT\0'
+LOG_VERSION = 1
+REC_BEGIN, REC_SYSCALL, REC_EXIT, REC_BREAK, \
+    REC_FILE, REC_PAGES, REC_EXECS, REC_STORE, REC_HISTORY = range(1, 10)
+BREAK_KINDS = ['ecall', 'first', 'firstrvc', 'repeat']
+
+# monitor trace of rv-sim -M, see CheckpointManager in src/util/fmt.h
+TRACE = struct.Struct('<QQ')  # kind, value
+TRACE_EXECUTE, TRACE_SYSCALL, TRACE_STOP = range(1, 4)
+
+MANIFEST_VERSION = 2  # bump when outputs change for the same inputs
+
+
+@contextlib.contextmanager
+def atomic_open(path: str, mode: str = 'w'):
+    # write to a private file and rename it on success, so that a
+    # crash never leaves a truncated file behind
+    dirname, basename = os.path.split(path)
+    tmppath = os.path.join(dirname, '.%s.%d' % (basename, os.getpid()))
+    f = open(tmppath, mode)
+    try:
+        yield f
+    except BaseException:
+        f.close()
+        os.unlink(tmppath)
+        raise
+    f.close()
+    os.replace(tmppath, path)
+
+
+def digest_sources(names: List[str]) -> bytes:
+    sig = hashlib.sha256()
+    sig.update(os.environ.get('TOOLCHAIN', '').encode('utf-8'))
+    for name in names:
+        with open(os.path.join(SRC_DIR, name), 'rb') as f:
+            sig.update(f.read())
+    return sig.digest()
+
+
+def digest_file(path: str) -> str:
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+
+class Profiler:
+    '''
+    Records stages as complete events of the Chrome trace format, with
+    the wall time, cpu time of the thread and of waited children, the
+    subprocesses started and the peak rss of the process. A forked
+    worker saves its events to a part file next to the trace, which the
+    front end merges in the end.
+    '''
+    path = None  # of the trace, or None if not profiling
+    events = []
+    checkpoint = None  # being processed by this process
+    pids = []  # of the workers forked by the front end
+    local = threading.local()  # subprocesses started by each thread
+
+    @staticmethod
+    def reset(path: str = None):
+        # for a new run in the same process, e.g. of bench.py
+        Profiler.path = path
+        Profiler.events = []
+        Profiler.checkpoint = None
+        Profiler.pids = []
+
+    @staticmethod
+    def spawned():
+        Profiler.local.spawns = getattr(Profiler.local, 'spawns', 0) + 1
+
+    @staticmethod
+    @contextlib.contextmanager
+    def stage(name: str, checkpoint: str = None):
+        if Profiler.path is None:
+            yield
+            return
+        # children are those waited by any thread, so their cpu time
+        # is only approximate for stages running in threads
+        spawns = getattr(Profiler.local, 'spawns', 0)
+        begin = time.time()
+        cpu = time.thread_time()
+        child = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield
+        finally:
+            end = time.time()
+            child_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            child_cpu = child_end.ru_utime + child_end.ru_stime - \
+                child.ru_utime - child.ru_stime
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            Profiler.events.append({
+                'name': name, 'cat': 'stage', 'ph': 'X',
+                'ts': round(begin * 1e6), 'dur': round((end - begin) * 1e6),
+                'pid': os.getpid(), 'tid': threading.get_native_id(),
+                'args': {
+                    'checkpoint': checkpoint or Profiler.checkpoint,
+                    'cpu_ms': round((time.thread_time() - cpu) * 1e3, 3),
+                    'child_cpu_ms': round(child_cpu * 1e3, 3),
+                    'spawns': getattr(Profiler.local, 'spawns', 0) - spawns,
+                    'peak_rss_kb': usage.ru_maxrss}})
+
+    @staticmethod
+    def fork(name: str):
+        # in a new worker, dropping the events of the front end
+        Profiler.events = [{'name': 'process_name', 'ph': 'M',
+                            'pid': os.getpid(), 'args': {'name': name}}]
+
+    @staticmethod
+    def save_part():
+        if Profiler.path is not None:
+            with atomic_open('%s.%d' % (Profiler.path, os.getpid())) as f:
+                json.dump(Profiler.events, f)
+
+    @staticmethod
+    def save():
+        # merge and remove the parts of the workers of this run only, as
+        # parts left by a killed run may share the name; a worker killed
+        # by a signal leaves no part
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+                   'args': {'name': 'parse.py'}}] + Profiler.events
+        for pid in Profiler.pids:
+            path = '%s.%d' % (Profiler.path, pid)
+            try:
+                with open(path) as f:
+                    events += json.load(f)
+            except FileNotFoundError:
+                continue
+            os.unlink(path)
+        Profiler.events = events
+        with atomic_open(Profiler.path) as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    @staticmethod
+    def report(top: int = 10):
+        # stages by their total wall time, inclusive of nested ones
+        stages = {}  # name: [calls, wall, cpu, child cpu, spawns, rss]
+        checkpoints = []  # (wall, name)
+        for event in Profiler.events:
+            if event['ph'] != 'X':
+                continue
+            info = event['args']
+            stat = stages.setdefault(event['name'], [0, 0, 0, 0, 0, 0])
+            stat[0] += 1
+            stat[1] += event['dur'] / 1e6
+            stat[2] += info['cpu_ms'] / 1e3
+            stat[3] += info['child_cpu_ms'] / 1e3
+            stat[4] += info['spawns']
+            stat[5] = max(stat[5], info['peak_rss_kb'])
+            if event['name'] == 'checkpoint':
+                checkpoints.append((event['dur'] / 1e6, info['checkpoint']))
+
+        print('%-12s %7s %9s %9s %9s %7s %9s' % (
+            'stage', 'calls', 'wall s', 'cpu s', 'child s', 'spawns',
+            'peak MiB'))
+        for name, stat in sorted(stages.items(), key=lambda s: -s[1][1]):
+            print('%-12s %7d %9.3f %9.3f %9.3f %7d %9.1f' % (
+                name, *stat[:5], stat[5] / 1024))
+        if checkpoints:
+            print('slowest checkpoints:')
+            for wall, name in sorted(checkpoints, reverse=True)[:top]:
+                print('%9.3fs %s' % (wall, name))
+
+
+class StubCache:
+    '''
+    On-disk cache of built stubs shared by all processes. Entries
+    are named by the hash of the target, its arguments and all the
+    sources it depends on, so editing a source never hits a stale
+    entry. Hits refresh the mtime, which is used for LRU eviction.
+    Verifier keeps its results in another one under its own keys.
+    '''
+    SOURCES = ['Makefile', 'jump.S', 'near.S', 'far.S']
+    TRIM_PERIOD = 256
+
+    def __init__(self, path: str, max_size: int):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.puts = 0
+        os.makedirs(path, exist_ok=True)
+
+        self.salt = digest_sources(StubCache.SOURCES)
+
+    def key(self, target: str, args: List[str]) -> str:
+        sig = (target + '\t' + '\t'.join(args)).encode('utf-8')
+        return hashlib.sha256(self.salt + sig).hexdigest()
+
+    def get(self, key: str) -> bytes:
+        path = os.path.join(self.path, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:  # missing or evicted by others
+            return None
+        return data
+
+    def put(self, key: str, data: bytes):
+        with atomic_open(os.path.join(self.path, key), 'wb') as f:
+            f.write(data)
+
+        self.puts += 1
+        if self.puts % StubCache.TRIM_PERIOD == 0:
+            self.trim()
+
+    def trim(self):
+        entries = []  # (mtime, size, path)
+        total_size = 0
+        for entry in os.scandir(self.path):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total_size += st.st_size
+
+        # evict least recently used entries
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+class Encoder:
+    '''
+    Emits the same bytes as the toolchain does for jump.S, near.S and
+    far.S. Instructions are compressed exactly where the assembler
+    compresses them, i.e. never when a %hi/%lo operand is involved.
+    '''
+    ZERO, RA, SP, A0, A1 = 0, 1, 2, 10, 11
+
+    @staticmethod
+    def hi(addr: int) -> int:
+        hi = (addr + 0x800) >> 12
+        assert hi >= 0 and hi < 1 << 20, 'lui expression not in range'
+        return hi
+
+    @staticmethod
+    def lo(addr: int) -> int:
+        return ((addr & 0xfff) ^ 0x800) - 0x800
+
+    @staticmethod
+    def i32(inst: int) -> bytes:
+        return inst.to_bytes(4, 'little')
+
+    @staticmethod
+    def i16(inst: int) -> bytes:
+        return inst.to_bytes(2, 'little')
+
+    @staticmethod
+    def lui(rd: int, imm: int) -> bytes:
+        return Encoder.i32(imm << 12 | rd << 7 | 0x37)
+
+    @staticmethod
+    def ld(rd: int, rs1: int, imm: int) -> bytes:
+        imm &= 0xfff
+        return Encoder.i32(imm << 20 | rs1 << 15 | 3 << 12 | rd << 7 | 0x03)
+
+    @staticmethod
+    def sd(rs2: int, rs1: int, imm: int) -> bytes:
+        imm &= 0xfff
+        return Encoder.i32((imm >> 5) << 25 | rs2 << 20 | rs1 << 15 |
+                           3 << 12 | (imm & 0x1f) << 7 | 0x23)
+
+    @staticmethod
+    def jalr(rd: int, rs1: int, imm: int) -> bytes:
+        imm &= 0xfff
+        return Encoder.i32(imm << 20 | rs1 << 15 | rd << 7 | 0x67)
+
+    @staticmethod
+    def jal(rd: int, offs: int) -> bytes:
+        assert offs < J_MAX_OFFS and offs >= -J_MAX_OFFS and offs & 1 == 0
+        imm = offs & 0x1fffff
+        imm = ((imm >> 20) << 31 | ((imm >> 1) & 0x3ff) << 21 |
+               ((imm >> 11) & 1) << 20 | ((imm >> 12) & 0xff) << 12)
+        return Encoder.i32(imm | rd << 7 | 0x6f)
+
+    @staticmethod
+    def c_mv(rd: int, rs2: int) -> bytes:
+        return Encoder.i16(0x8002 | rd << 7 | rs2 << 2)
+
+    @staticmethod
+    def c_jr(rs1: int) -> bytes:
+        return Encoder.i16(0x8002 | rs1 << 7)
+
+    @staticmethod
+    def c_jalr(rs1: int) -> bytes:
+        return Encoder.i16(0x9002 | rs1 << 7)
+
+    @staticmethod
+    def c_addi16sp(imm: int) -> bytes:
+        imm &= 0x3ff
+        imm = (((imm >> 9) & 1) << 12 | ((imm >> 4) & 1) << 6 |
+               ((imm >> 6) & 1) << 5 | ((imm >> 7) & 3) << 3 |
+               ((imm >> 5) & 1) << 2)
+        return Encoder.i16(0x6101 | imm)
+
+    @staticmethod
+    def c_addi4spn(rd: int, imm: int) -> bytes:
+        imm = (((imm >> 4) & 3) << 11 | ((imm >> 6) & 0xf) << 7 |
+               ((imm >> 2) & 1) << 6 | ((imm >> 3) & 1) << 5)
+        return Encoder.i16(imm | (rd - 8) << 2)
+
+    @staticmethod
+    def c_sdsp(rs2: int, imm: int) -> bytes:
+        imm = ((imm >> 3) & 7) << 10 | ((imm >> 6) & 7) << 7
+        return Encoder.i16(0xe002 | imm | rs2 << 2)
+
+    @staticmethod
+    def c_ldsp(rd: int, imm: int) -> bytes:
+        imm = (((imm >> 5) & 1) << 12 | ((imm >> 3) & 3) << 5 |
+               ((imm >> 6) & 7) << 2)
+        return Encoder.i16(0x6002 | imm | rd << 7)
+
+    @staticmethod
+    def jump(offset: int) -> bytes:
+        return Encoder.jal(Encoder.ZERO, offset)
+
+    @staticmethod
+    def near(near_buf: int, far_pc: int = None,
+             alter_rd: int = None) -> bytes:
+        E = Encoder
+        buf = []
+        alter_sp = alter_rd == E.SP
+        if alter_rd == E.A0 or alter_sp:
+            alter_rd = None
+
+        if far_pc is not None:
+            if alter_rd is not None:
+                buf.append(E.c_mv(alter_rd, E.A0))
+            if alter_sp:
+                buf.append(E.lui(E.SP, E.hi(near_buf)))
+                buf.append(E.sd(E.A0, E.SP, E.lo(near_buf)))
+            else:
+                buf.append(E.lui(E.A0, E.hi(near_buf)))
+                buf.append(E.sd(E.SP, E.A0, E.lo(near_buf)))
+            buf.append(E.lui(E.A0, E.hi(far_pc)))
+            buf.append(E.jalr(E.A0, E.A0, E.lo(far_pc)))
+
+        if alter_rd is not None:
+            buf.append(E.c_mv(E.SP, E.A0))
+            buf.append(E.c_mv(E.A0, alter_rd))
+            buf.append(E.c_mv(alter_rd, E.SP))
+        if alter_sp:
+            buf.append(E.c_mv(E.SP, E.A0))
+            buf.append(E.lui(E.A0, E.hi(near_buf)))
+            buf.append(E.ld(E.A0, E.A0, E.lo(near_buf)))
+        else:
+            buf.append(E.lui(E.SP, E.hi(near_buf)))
+            buf.append(E.ld(E.SP, E.SP, E.lo(near_buf)))
+
+        return b''.join(buf)
+
+    @staticmethod
+    def far(replay_sp: int, replay_pc: int) -> bytes:
+        E = Encoder
+        # caller-saved registers except sp, spilled in far.S order
+        saved = [1, 5, 6, 7, 10, 11, 12, 13, 14, 15, 16, 17, 28, 29, 30, 31]
+        buf = [E.lui(E.SP, E.hi(replay_sp)),
+               E.ld(E.SP, E.SP, E.lo(replay_sp)),
+               E.c_addi16sp(-128)]
+        for i, reg in enumerate(saved):
+            buf.append(E.c_sdsp(reg, i * 8))
+
+        buf += [E.c_ldsp(E.A0, 128),
+                E.c_addi4spn(E.A1, 136),
+                E.lui(E.RA, E.hi(replay_pc)),
+                E.ld(E.RA, E.RA, E.lo(replay_pc)),
+                E.c_jalr(E.RA),
+                E.c_sdsp(E.A0, 128),
+                E.ld(E.A0, E.A0, -8)]
+
+        # a0 holds the return value
+        for i, reg in enumerate(saved):
+            if reg != E.A0:
+                buf.append(E.c_ldsp(reg, i * 8))
+        buf += [E.c_ldsp(E.SP, 32),
+                E.c_jr(E.SP)]
+
+        return b''.join(buf)
+
 
 class MakeHelper:
     identifier = b''
+    toolchain = False  # build with make instead of Encoder
+    cache = None  # StubCache
+    memo = {}  # (target, args): data
 
     @staticmethod
     def make(target: str, args: List[str]) -> bytes:
+        memo_key = (target, tuple(args))
+        data = MakeHelper.memo.get(memo_key)
+        if data is not None:
+            return data
+
+        cache = MakeHelper.cache
+        if cache is not None:
+            cache_key = cache.key(target, args)
+            data = cache.get(cache_key)
+        if data is None:
+            with Profiler.stage('make'):
+                data = MakeHelper.build(target, args)
+            if cache is not None:
+                cache.put(cache_key, data)
+
+        MakeHelper.memo[memo_key] = data
+        return data
+
+    @staticmethod
+    def build(target: str, args: List[str]) -> bytes:
         # make output name unique
         sig = (target + '\t'.join(args)).encode('utf-8')
         sig += MakeHelper.identifier
@@ -37,20 +505,25 @@ class MakeHelper:
         base, ext = os.path.splitext(target)
         target = base + sig + ext
 
-        os.chdir(SRC_DIR)
+        # in SRC_DIR without changing the cwd, which a retry in the
+        # same process still needs
         cmd = ['make', target] + args
-        p = Popen(cmd, stdout=DEVNULL)
+        p = Popen(cmd, stdout=DEVNULL, cwd=SRC_DIR)
+        Profiler.spawned()
         if p.wait():
-            exit(p.returncode)
+            raise Exception('make %s failed with %d' % (target, p.returncode))
+        target = os.path.join(SRC_DIR, target)
         with open(target, 'rb') as f:
             data = f.read()
         os.remove(target)
-        os.chdir(WORK_DIR)
         return data
 
     @staticmethod
     def jump(offset: int, norvc: bool = True):
         assert offset < J_MAX_OFFS and offset >= -J_MAX_OFFS
+        # whether an rvc jump gets compressed is up to the assembler
+        if norvc and not MakeHelper.toolchain:
+            return Encoder.jump(offset)
         args = ['OFFSET=%d' % offset]
         if norvc:
             args += ['NORVC=1']
@@ -60,6 +533,10 @@ class MakeHelper:
     def near(ret_pc: int, near_pc: int, near_buf: int,
              far_pc: int = None, alter_rd: int = None,
              norvc: bool = True) -> bytes:
+        if not MakeHelper.toolchain:
+            near = Encoder.near(near_buf, far_pc, alter_rd)
+            ret = Encoder.jump(ret_pc - near_pc - len(near))
+            return near + ret
         args = ['NEAR_BUF=0x%x' % near_buf]
         if far_pc is not None:
             args += ['FAR_CALL=0x%x' % far_pc]
@@ -76,23 +553,169 @@ class MakeHelper:
 
     @staticmethod
     def far(replay_sp: int, replay_pc: int):
+        if not MakeHelper.toolchain:
+            return Encoder.far(replay_sp, replay_pc)
         args = ['REPLAY_SP=0x%x' % replay_sp, 'REPLAY_PC=0x%x' % replay_pc]
         return MakeHelper.make('far.bin', args)
 
 
+class ElfText:
+    '''
+    The .text section of a riscv64 ELF, along with the symbols in it,
+    where a disassembler restarts decoding, and the ranges marked as
+    data by $d mapping symbols.
+    '''
+    EHDR = struct.Struct('<16sHHIQQQIHHHHHH')
+    SHDR = struct.Struct('<IIQQQQIIQQ')
+    SYM = [('name', '<u4'), ('info', 'u1'), ('other', 'u1'),
+           ('shndx', '<u2'), ('value', '<u8'), ('size', '<u8')]
+    EM_RISCV = 243
+    SHT_SYMTAB = 2
+    STT_FILE = 4
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            elf = f.read()
+        ident, _, machine, *_, shoff, _, _, _, _, shentsize, shnum, \
+            shstrndx = ElfText.EHDR.unpack_from(elf)
+        assert ident[:4] == b'\x7fELF' and ident[4:6] == b'\2\1' and \
+            machine == ElfText.EM_RISCV, 'expected a riscv64 elf'
+
+        shdrs = [ElfText.SHDR.unpack_from(elf, shoff + i * shentsize)
+                 for i in range(shnum)]
+        shstrtab = shdrs[shstrndx][4]
+        text_i = None
+        for i, shdr in enumerate(shdrs):
+            name = elf[shstrtab + shdr[0]:elf.index(b'\0', shstrtab + shdr[0])]
+            if name == b'.text':
+                text_i = i
+        assert text_i is not None, 'no .text section'
+        _, _, _, self.addr, offs, size, *_ = shdrs[text_i]
+        self.data = elf[offs:offs + size]
+
+        self.symbols = np.zeros(0, dtype=np.int64)
+        self.data_ranges = []  # (begin, end)
+        for shdr in shdrs:
+            if shdr[1] != ElfText.SHT_SYMTAB:
+                continue
+            syms = np.frombuffer(elf, dtype=ElfText.SYM,
+                                 count=shdr[5] // shdr[9], offset=shdr[4])
+            syms = syms[(syms['shndx'] == text_i) &
+                        (syms['info'] & 0xf != ElfText.STT_FILE)]
+            strtab = shdrs[shdr[6]][4]
+            names = np.frombuffer(elf, dtype=np.uint8)
+            is_data = ((names[strtab + syms['name']] == ord('$')) &
+                       (names[strtab + syms['name'] + 1] == ord('d')))
+            addrs = syms['value'].astype(np.int64)
+            self.symbols = np.unique(addrs)
+            for begin in np.unique(addrs[is_data]).tolist():
+                i = np.searchsorted(self.symbols, begin, side='right')
+                end = self.symbols[i] if i < len(self.symbols) \
+                    else self.addr + size
+                self.data_ranges.append((begin, int(end)))
+
+
 class BBVBase:
     LINE = re.compile(r'^\s+([0-9a-f]+):\s+[0-9a-f]+\s+(\S+)')
     CFIS = {
         'jal', 'jalr', 'beq', 'bne', 'blt', 'bge', 'bltu', 'bgeu',
         'c.j', 'c.jal', 'c.jr', 'c.jalr', 'c.beqz', 'c.bnez'}
 
-    def __init__(self, path: str):
+    VERSION = 2  # bump when the cfis found in a binary may change
+
+    def __init__(self, path: str, cache_dir: str = None):
+        assert np is not None, 'numpy is required for bbv'
+        self.sig = BBVBase.digest(path)
+        if cache_dir is None:
+            self.set_cfis(BBVBase.decode(path))
+            return
+
+        # cfis are cached by the content of the binary
+        cache_dir = os.path.join(cache_dir, 'cfi')
+        cache_path = os.path.join(cache_dir, self.sig + '.npy')
+        try:
+            pcs = np.load(cache_path)
+            print(path, 'loaded cached cfis')
+        except FileNotFoundError:
+            pcs = BBVBase.decode(path)
+            os.makedirs(cache_dir, exist_ok=True)
+            with atomic_open(cache_path, 'wb') as f:
+                np.save(f, pcs)
+        self.set_cfis(pcs)
+
+    @staticmethod
+    def digest(path: str) -> str:
+        sig = hashlib.sha256()
+        sig.update(('%d\t%s' % (BBVBase.VERSION, '\t'.join(
+            sorted(BBVBase.CFIS)))).encode('utf-8'))
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(1 << 20)
+                if not data:
+                    break
+                sig.update(data)
+        return sig.hexdigest()
+
+    @staticmethod
+    def decode(path: str) -> 'np.ndarray':
+        print(path, 'decoding')
+        text = ElfText(path)
+        h = np.frombuffer(text.data, dtype='<u2',
+                          count=len(text.data) // 2).astype(np.int64)
+        n = len(h)
+        i = np.arange(n)
+
+        # objdump restarts decoding at every symbol
+        resync = np.zeros(n, dtype=bool)
+        resync[0:1] = True
+        offs = text.symbols - text.addr
+        offs = offs[(offs >= 0) & (offs < n * 2) & (offs & 1 == 0)]
+        resync[offs >> 1] = True
+
+        # find where instructions start: a run of halfwords that look
+        # like the first half of a 32-bit instruction is decoded as
+        # every other halfword from the beginning of the run, and the
+        # halfword after the run is the upper half of the last one if
+        # the run has odd length
+        wide = h & 3 == 3
+        prev_wide = np.concatenate(([False], wide[:-1]))
+        begin = wide & (~prev_wide | resync)
+        run_begin = np.maximum.accumulate(np.where(begin, i, 0))
+        start_wide = wide & ((i - run_begin) & 1 == 0)
+        start_wide[n - 1:] = False  # truncated
+        prev_start = np.concatenate(([False], start_wide[:-1]))
+        start = start_wide | (~wide & (resync | ~prev_start))
+        for data_begin, data_end in text.data_ranges:
+            data_begin = (data_begin - text.addr) >> 1
+            data_end = (data_end - text.addr + 1) >> 1
+            start[max(data_begin, 0):max(data_end, 0)] = False
+
+        # classify control flow instructions
+        w = h | np.concatenate((h[1:], [0])) << 16
+        op, funct3 = w & 0x7f, (w >> 12) & 7
+        cfi = wide & (
+            (op == 0x6f) |  # jal
+            (op == 0x67) & (funct3 == 0) |  # jalr
+            (op == 0x63) & (funct3 != 2) & (funct3 != 3))  # b*
+        op, funct3 = h & 3, h >> 13
+        rs1, rs2 = (h >> 7) & 0x1f, (h >> 2) & 0x1f
+        cfi |= ~wide & (
+            (op == 1) & (funct3 >= 5) |  # c.j, c.beqz, c.bnez
+            (op == 2) & (funct3 == 4) & (rs2 == 0) & (rs1 != 0))  # c.jr, c.jalr
+
+        pcs = text.addr + (np.nonzero(start & cfi)[0] << 1)
+        print(path, 'done')
+        return pcs.astype(np.int64)
+
+    @staticmethod
+    def disassemble(path: str) -> 'np.ndarray':
         print(path, 'disassembling')
         cmd = ['riscv64-unknown-linux-gnu-objdump', '-d',
                '-z', '-j', '.text', '-Mno-aliases', path]
         p = Popen(cmd, stdout=PIPE, encoding='utf-8')
+        Profiler.spawned()
 
-        self.cfi_map = {}
+        pcs = []
         while True:
             line = p.stdout.readline()
             if not line:
@@ -102,48 +725,387 @@ class BBVBase:
                 continue
             pc, inst = m.groups()
             if inst in BBVBase.CFIS:
-                index = len(self.cfi_map) + 1
-                self.cfi_map[int(pc, 16)] = index
+                pcs.append(int(pc, 16))
 
         if p.wait():
             exit(p.returncode)
         print(path, 'done')
+        return np.array(pcs, dtype=np.int64)
+
+    def set_cfis(self, pcs: 'np.ndarray'):
+        # pcs are in index order, i.e. pcs[i] is numbered i + 1
+        order = np.argsort(pcs, kind='stable')
+        self.pcs = pcs[order]
+        self.pns = self.pcs >> PAGE_OFFS
+        self.slots = (self.pcs & PAGE_OFFS_MASK) >> 1
+        self.indexes = order + 1
+
+    def page_cfis(self, pn: int) -> Tuple['np.ndarray', 'np.ndarray']:
+        # exec count slots of the cfis in a page, and their indexes
+        lo, hi = np.searchsorted(self.pns, [pn, pn + 1])
+        return self.slots[lo:hi], self.indexes[lo:hi]
 
     def index(self, pc: int) -> int:
-        return self.cfi_map.get(pc)
+        i = np.searchsorted(self.pcs, pc)
+        if i < len(self.pcs) and self.pcs[i] == pc:
+            return int(self.indexes[i])
+        return None
+
+
+class BinaryLog:
+    '''
+    Read-only mapping of a binary checkpoint log. After a header of
+    magic and version, each record is a 32-bit type, a 32-bit size and
+    the payload padded to 8 bytes. Payloads are returned as views into
+    the mapping, so syscall write data is never copied.
+        begin    <addr> <ireg0> ... <ireg31> <freg0> ... <freg31>
+        syscall  <addr> <retval> [<waddr> <wdata>]
+        exit     <addr> <retval>
+        break    <addr> <kind:u32> <rd:i32> <times>
+        file     <path>
+        pages    <pn> ...
+        execs    <pn> ...
+        store    <addr> <size> <data>
+        history  <syscalls> <value> ...
+    All fields are 64-bit little-endian unless noted.
+    '''
+
+    HEADER = struct.Struct('<8sII')
+    RECORD = struct.Struct('<II')
+    BREAK = struct.Struct('<QIiQ')
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = memoryview(mm)
+        magic, version, _ = self.HEADER.unpack_from(self.buf)
+        assert magic == LOG_MAGIC, 'Not a binary log'
+        if version != LOG_VERSION:
+            raise Exception('%s: unsupported log version %d' % (path, version))
+
+    @staticmethod
+    def is_binary(path: str) -> bool:
+        with open(path, 'rb') as f:
+            return f.read(len(LOG_MAGIC)) == LOG_MAGIC
+
+    def records(self, begin: int = HEADER.size, end: int = None):
+        # yields (offset, type, payload)
+        buf = self.buf
+        end = len(buf) if end is None else end
+        unpack_from = self.RECORD.unpack_from
+        while begin < end:
+            rtype, size = unpack_from(buf, begin)
+            offs = begin + self.RECORD.size
+            payload = buf[offs:offs + size]
+            assert len(payload) == size, 'Unexpected EOF'
+            yield begin, rtype, payload
+            begin = offs + ((size + 7) & ~7)
+
+
+class DumpFile:
+    '''
+    Read-only mapping of a checkpoint dump. Records are returned as
+    views into the mapping, so pages that are never modified go from
+    the input to the output file without being copied by Python.
+    '''
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.buf = memoryview(mm)
+            else:
+                self.buf = memoryview(b'')
+        self.offs = 0
+
+    def read(self, size: int) -> memoryview:
+        data = self.buf[self.offs:self.offs + size]
+        assert len(data) == size, 'Unexpected EOF'
+        self.offs += size
+        return data
 
 
 class Page:
+    __slots__ = ('bitmap', 'data', 'exec_count', 'refs')
 
     def __init__(self, bitmap: Union[int, bytes], data: bytes):
         if isinstance(bitmap, int):
             self.bitmap = bitmap
         else:
             self.bitmap = int.from_bytes(bitmap, 'little')
-        self.data = io.BytesIO(data)
+        self.data = data  # read-only until the first put
         self.exec_count = None
+        self.refs = 1  # number of PageMaps sharing this page
+
+    def copy(self) -> 'Page':
+        data = self.data
+        if isinstance(data, bytearray):
+            data = bytearray(data)
+        page = Page(self.bitmap, data)
+        page.exec_count = self.exec_count  # never modified once set
+        return page
 
     def set_exec_count(self, data: bytes):
-        self.exec_count = [None] * (PAGE_SIZE // 2)
-        for i in range(PAGE_SIZE // 2):
-            b, e = i * 4, (i + 1) * 4
-            count = int.from_bytes(data[b:e], 'little')
-            self.exec_count[i] = count
+        if sys.byteorder == 'little':
+            self.exec_count = memoryview(data).cast('I')
+        else:
+            self.exec_count = array('I', data)
+            self.exec_count.byteswap()
+        assert self.exec_count.itemsize == 4
+        assert len(self.exec_count) == PAGE_SIZE // 2
 
     def put(self, offs: int, data: bytes):
         assert offs + len(data) <= PAGE_SIZE
-        self.data.seek(offs)
-        self.data.write(data)
+        if not isinstance(self.data, bytearray):
+            self.data = bytearray(self.data)
+        self.data[offs:offs + len(data)] = data
         self.bitmap |= ((1 << len(data)) - 1) << offs
 
     def is_free(self, offs: int) -> bool:
         return self.bitmap & (1 << offs) == 0
 
-    def get(self) -> bytes:
-        self.data.seek(0)
-        data = self.data.read()
-        assert len(data) == PAGE_SIZE
-        return data
+    def get(self) -> memoryview:
+        assert len(self.data) == PAGE_SIZE
+        return memoryview(self.data)
+
+    def fill(self) -> int:
+        # the byte repeated all over the page, or None
+        if self.data is ZERO_PAGE:
+            return 0
+        data = self.get()
+        fill = data[0]
+        if data[-1] != fill:
+            return None
+        if data.tobytes() != bytes((fill,)) * PAGE_SIZE:
+            return None
+        return fill
+
+
+def writev(f: io.BufferedWriter, views: List[memoryview]):
+    # write buffers straight from their owners, without gathering
+    # them into a single bytes object or the file's buffer
+    try:
+        fd = f.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        f.writelines(views)
+        return
+    f.flush()
+    iov_max = os.sysconf('SC_IOV_MAX')
+    i = 0
+    while i < len(views):
+        n = os.writev(fd, views[i:i + iov_max])
+        # skip what has been written, including partial writes
+        while i < len(views) and n >= len(views[i]):
+            n -= len(views[i])
+            i += 1
+        if n:
+            views[i] = views[i][n:]
+
+
+class PageStore:
+    '''
+    Content-addressed store of pages shared by checkpoints. Unique
+    pages are appended to a pack file and their sha256 to an index
+    file, so the i-th digest names the i-th page of the pack. Instead
+    of a .dump, a checkpoint then keeps a .pages file with the index
+    of each of its pages, which export() expands back to the .dump.
+
+    Appends are serialized by a lock on the index file. The pack is
+    written before the index, so every digest names a complete page,
+    and whatever a crash left past the last one is overwritten.
+    '''
+    PACK = 'pages.pack'
+    INDEX = 'pages.idx'
+    DIGEST_SIZE = 32
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.digests = {}  # digest: index
+        self.count = 0  # number of digests read
+
+    def open(self, name: str) -> io.BufferedRandom:
+        fd = os.open(os.path.join(self.path, name),
+                     os.O_RDWR | os.O_CREAT, 0o644)
+        return open(fd, 'r+b')
+
+    def sync(self, f: io.BufferedRandom):
+        # read the digests appended since the last sync
+        f.seek(self.count * PageStore.DIGEST_SIZE)
+        data = f.read()
+        size = PageStore.DIGEST_SIZE
+        for i in range(0, len(data) - size + 1, size):
+            self.digests[data[i:i + size]] = self.count
+            self.count += 1
+
+    def refresh(self):
+        with self.open(PageStore.INDEX) as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            self.sync(f)
+
+    def put(self, views: List[memoryview]) -> array:
+        digests = [hashlib.sha256(view).digest() for view in views]
+        indexes = array('Q')
+        with self.open(PageStore.INDEX) as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            self.sync(f)
+            base = self.count
+            new_digests, new_views = [], []
+            for digest, view in zip(digests, views):
+                index = self.digests.get(digest)
+                if index is None:
+                    index = self.count
+                    self.digests[digest] = index
+                    self.count += 1
+                    new_digests.append(digest)
+                    new_views.append(view)
+                indexes.append(index)
+
+            if new_views:
+                with self.open(PageStore.PACK) as pack:
+                    pack.seek(base * PAGE_SIZE)
+                    pack.truncate()
+                    writev(pack, new_views)
+                f.seek(base * PageStore.DIGEST_SIZE)
+                f.write(b''.join(new_digests))
+        return indexes
+
+    def export(self, pages_path: str, dump_path: str):
+        # expand a .pages file into a standalone .dump
+        indexes = array('Q')
+        with open(pages_path, 'rb') as f:
+            indexes.frombytes(f.read())
+        if sys.byteorder != 'little':
+            indexes.byteswap()
+        if not indexes:
+            with atomic_open(dump_path, 'wb'):
+                return
+
+        with open(os.path.join(self.path, PageStore.PACK), 'rb') as f:
+            pack = memoryview(mmap.mmap(f.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
+        count = len(pack) // PAGE_SIZE
+        views = []
+        for index in indexes:
+            assert index < count, 'Page %d not in %s' % (index, self.path)
+            views.append(pack[index * PAGE_SIZE:(index + 1) * PAGE_SIZE])
+        with atomic_open(dump_path, 'wb') as f:
+            writev(f, views)
+
+    @contextlib.contextmanager
+    def expanded(self, pages_path: str):
+        # yields the path of a private .dump expanded from a .pages
+        dirname, basename = os.path.split(pages_path[:-len('.pages')])
+        tmppath = os.path.join(dirname, '.%s.dump.%d.%d' % (
+            basename, os.getpid(), threading.get_ident()))
+        self.export(pages_path, tmppath)
+        try:
+            yield tmppath
+        finally:
+            os.unlink(tmppath)
+
+
+class FreeList:
+    '''
+    Free ranges sorted by address. Ranges only shrink, so they are
+    indexed by a segment tree over their positions holding the max
+    length, which finds the nearest range that fits in O(log n).
+    '''
+
+    def __init__(self, ranges: List[Tuple[int, int]]):
+        self.begins = [begin for begin, _ in ranges]
+        self.ends = [end for _, end in ranges]
+        self.leaf = 1
+        while self.leaf < len(ranges):
+            self.leaf <<= 1
+
+        # lay out levels from the root down, with the root at 1
+        level = [end - begin for begin, end in ranges]
+        level += [0] * (self.leaf - len(ranges))
+        levels = [level]
+        while len(level) > 1:
+            level = list(map(max, level[0::2], level[1::2]))
+            levels.append(level)
+        self.tree = [0]
+        for level in reversed(levels):
+            self.tree += level
+
+    def __len__(self) -> int:
+        return len(self.begins)
+
+    def __getitem__(self, i: int) -> Tuple[int, int]:
+        return self.begins[i], self.ends[i]
+
+    def update(self, i: int, begin: int, end: int):
+        self.begins[i] = begin
+        self.ends[i] = end
+        node = self.leaf + i
+        self.tree[node] = end - begin
+        while node > 1:
+            node >>= 1
+            self.tree[node] = max(self.tree[node * 2],
+                                  self.tree[node * 2 + 1])
+
+    def find_prev(self, i: int, size: int) -> int:
+        # the last range at or before i that fits
+        if i < 0:
+            return None
+        tree = self.tree
+        node = self.leaf + i
+        while tree[node] < size:
+            while not node & 1:  # climb while being a left child
+                node >>= 1
+            if node == 1:
+                return None
+            node -= 1
+        while node < self.leaf:
+            node = node * 2 + 1 if tree[node * 2 + 1] >= size else node * 2
+        return node - self.leaf
+
+    def find_next(self, i: int, size: int) -> int:
+        # the first range at or after i that fits
+        if i >= len(self.begins):
+            return None
+        tree = self.tree
+        node = self.leaf + i
+        while tree[node] < size:
+            while node & 1:  # climb while being a right child
+                node >>= 1
+            if node == 0:
+                return None
+            node += 1
+        while node < self.leaf:
+            node = node * 2 if tree[node * 2] >= size else node * 2 + 1
+        return node - self.leaf
+
+    def take(self, base_addr: int, size: int) -> int:
+        # get upper bound and lower bound of free range
+        s = bisect.bisect_right(self.ends, base_addr) - 1
+        e = bisect.bisect_right(self.begins, base_addr)
+
+        # search both upwards and downwards
+        s = self.find_prev(s, size)
+        e = self.find_next(e, size)
+
+        # select the nearest free range
+        if s is not None and e is not None:
+            s_dist = base_addr - self.ends[s]
+            e_dist = self.begins[e] - base_addr
+            use_i = s if s_dist < e_dist else e
+        elif s is not None:
+            use_i = s
+        elif e is not None:
+            use_i = e
+        else:
+            raise Exception('failed to reserve')
+
+        begin, end = self[use_i]
+        if begin > base_addr:
+            self.update(use_i, begin + size, end)
+            return begin
+        else:
+            self.update(use_i, begin, end - size)
+            return end - size
 
 
 class PageMap:
@@ -153,12 +1115,38 @@ class PageMap:
 
     def __getitem__(self, pn: int) -> Page:
         if pn not in self._map:
-            self._map[pn] = Page(0, b'\0' * PAGE_SIZE)
+            self._map[pn] = Page(0, ZERO_PAGE)
         return self._map[pn]
 
     def __setitem__(self, pn: int, page: Page):
+        old = self._map.get(pn)
+        if old is not None:
+            old.refs -= 1
         self._map[pn] = page
 
+    def snapshot(self) -> 'PageMap':
+        # pages are shared until either map writes to them
+        pages = PageMap()
+        pages._map = self._map.copy()
+        for page in self._map.values():
+            page.refs += 1
+        return pages
+
+    def writable(self, pn: int) -> Page:
+        page = self[pn]
+        if page.refs > 1:
+            page.refs -= 1
+            page = page.copy()
+            self._map[pn] = page
+        return page
+
+    def release(self):
+        # drop the map, so that the maps it shared pages with no
+        # longer copy them before writing
+        for page in self._map.values():
+            page.refs -= 1
+        self._map = {}
+
     def put(self, addr: int, data: bytes):
         begin_pn = addr >> PAGE_OFFS
         end_pn = (addr + len(data) + PAGE_SIZE - 1) >> PAGE_OFFS
@@ -167,20 +1155,35 @@ class PageMap:
             end_addr = min(addr + len(data), (pn + 1) * PAGE_SIZE)
             offs = begin_addr & PAGE_OFFS_MASK
             part = data[begin_addr - addr: end_addr - addr]
-            self[pn].put(offs, part)
+            self.writable(pn).put(offs, part)
 
     def make_free_list(self) -> List[Tuple[int, int]]:
         free_list = []
         page_list = sorted(self._map.items())
         cur = FIRST_PN * PAGE_SIZE
 
+        def ctz(x: int) -> int:
+            return (x & -x).bit_length() - 1
+
         for pn, page in page_list:
             pa = pn * PAGE_SIZE
-            for i in range(PAGE_SIZE):
-                free = page.is_free(i)
-                if cur is None and free:  # begin a free range
+            used = page.bitmap
+            free = ~used & PAGE_MASK
+            # jump from one boundary of free ranges to the next
+            # instead of testing each bit
+            i = 0
+            while True:
+                if cur is None:  # begin a free range
+                    rest = free >> i
+                    if not rest:
+                        break
+                    i += ctz(rest)
                     cur = pa + i
-                elif cur is not None and not free:  # end
+                else:  # end
+                    rest = used >> i
+                    if not rest:
+                        break
+                    i += ctz(rest)
                     # align boundaries to 2 as instructions are 2-aligned
                     begin = (cur + 1) & ~1
                     end = (pa + i) & ~1
@@ -190,63 +1193,9 @@ class PageMap:
 
         return free_list
 
-    def reserve(self, free_list: List[Tuple[int, int]],
+    def reserve(self, free_list: 'FreeList',
                 base_addr: int, size: int) -> int:
-        # get upper bound and lower bound of free range
-        if base_addr < free_list[0][0]:
-            s, e = -1, 0
-        elif base_addr >= free_list[-1][1]:
-            s, e = len(free_list) - 1, len(free_list)
-        else:
-            s, e = 0, len(free_list) - 1
-            while s + 1 < e:  # binary search
-                m = (s + e) // 2
-                if free_list[m][1] <= base_addr:
-                    s = m
-                elif free_list[m][0] > base_addr:
-                    e = m
-
-        # search both upwards and downwards
-        s_hit, e_hit = False, False
-        while True:
-            do_s = s >= 0 and not s_hit
-            do_e = e < len(free_list) and not e_hit
-            if not (do_s or do_e):
-                break
-            if do_s:
-                if free_list[s][0] + size <= free_list[s][1]:
-                    s_hit = True
-                else:
-                    s -= 1
-            if do_e:
-                if free_list[e][1] - size >= free_list[e][0]:
-                    e_hit = True
-                else:
-                    e += 1
-
-        # select the nearest free range
-        if s_hit and e_hit:
-            s_dist = base_addr - free_list[s][1]
-            e_dist = free_list[e][0] - base_addr
-            if s_dist < e_dist:
-                use_i = s
-            else:
-                use_i = e
-        elif s_hit:
-            use_i = s
-        elif e_hit:
-            use_i = e
-        else:
-            raise Exception('failed to reserve')
-
-        # update free_list and page map
-        begin, end = free_list[use_i]
-        if free_list[use_i][0] > base_addr:
-            free_list[use_i] = (begin + size, end)
-            near_addr = begin
-        else:
-            free_list[use_i] = (begin, end - size)
-            near_addr = end - size
+        near_addr = free_list.take(base_addr, size)
         self.put(near_addr, b'\0' * size)
         return near_addr
 
@@ -261,45 +1210,67 @@ class PageMap:
                 break
         return cur
 
-    def dump(self, dumpfile: io.BytesIO, cfgfile: io.StringIO):
-        # merge successive pages
+    def dump(self, dumpfile: io.BufferedWriter, cfgfile: io.StringIO,
+             store: 'PageStore' = None):
+        # merge successive pages, keeping pages filled with a single
+        # byte (mostly zero) in runs of their own, which take no space
+        # in the dump
         page_list = sorted(self._map.items())
         last_pn = None
-        cfgs = []  # (pn, count)
-        for pn, _ in page_list:
-            if last_pn is None or last_pn + 1 < pn:
-                cfgs.append([pn, 1])
+        cfgs = []  # (pn, count, fill), fill is None for data pages
+        views = []
+        for pn, page in page_list:
+            fill = page.fill()
+            if fill is None:
+                views.append(page.get())
+            if last_pn is None or last_pn + 1 < pn or cfgs[-1][2] != fill:
+                cfgs.append([pn, 1, fill])
             else:
                 cfgs[-1][1] += 1
             last_pn = pn
 
-        # write configs
+        # write configs; a fill run has a length of 0 and the fill
+        # byte in place of the offset, see map_pages in cl.c
         cfgfile.write('%d\n' % len(cfgs))
         offs = 0
-        for pn, count in cfgs:
+        for pn, count, fill in cfgs:
             addr = pn * PAGE_SIZE
             size = count * PAGE_SIZE
+            if fill is not None:
+                cfgfile.write('%x\t%x\t%x\t%x\n' % (addr, fill, size, 0))
+                continue
             cfgfile.write('%x\t%x\t%x\t%x\n' % (addr, offs, size, size))
             offs += size
 
-        # write pages
-        for i, (pn, page) in enumerate(page_list):
-            dumpfile.write(page.get())
+        # write pages, or their indexes in the page store
+        if store is None:
+            writev(dumpfile, views)
+            return
+        indexes = store.put(views)
+        if sys.byteorder != 'little':
+            indexes.byteswap()
+        dumpfile.write(indexes.tobytes())
 
     def dump_bbv(self, bbv: BBVBase, f: io.StringIO):
-        page_list = sorted(self._map.items())
-        f.write('T')
-        for pn, page in page_list:
+        # gather the counts of executed cfis page by page, then
+        # format all of them at once
+        indexes, counts = [], []
+        for pn, page in sorted(self._map.items()):
             if page.exec_count is None:
                 continue
-            for i, count in enumerate(page.exec_count):
-                if not count:
-                    continue
-                pc = pn * PAGE_SIZE + i * 2
-                index = bbv.index(pc)
-                if index is not None:
-                    f.write(':%d:%d ' % (index, count))
-        f.write('\n')
+            slots, index = bbv.page_cfis(pn)
+            count = np.frombuffer(page.exec_count, dtype=np.uint32)[slots]
+            hits = count.nonzero()
+            indexes.append(index[hits])
+            counts.append(count[hits])
+
+        pairs = []
+        if indexes:
+            pairs = np.empty(sum(map(len, indexes)) * 2, dtype=np.int64)
+            pairs[0::2] = np.concatenate(indexes)
+            pairs[1::2] = np.concatenate(counts)
+            pairs = pairs.tolist()
+        f.write('T' + ':%d:%d ' * (len(pairs) // 2) % tuple(pairs) + '\n')
 
 
 class SysCall:
@@ -320,10 +1291,7 @@ class SysCall:
 
     def set_wdata(self, wdata: str):
         assert len(wdata) % 2 == 0
-        wbuf = bytearray()
-        for i in range(0, len(wdata), 2):
-            wbuf.append(int(wdata[i:i + 2], 16))
-        self.wdata = bytes(wbuf)
+        self.wdata = bytes.fromhex(wdata)
 
     def make_entry(self, verbose: bool) -> bytes:
         buf = []
@@ -354,33 +1322,155 @@ class Checkpoint:
         self.regs = []  # pc, 31 int, 32 fp
         self.syscalls = []
         self.breakpoint = None  # (pc, rd, repeat)
+        self.history = None  # [(syscalls, value)] of the breakpoint
         self.pages = PageMap()
         self.path_prefix = None
+        self.dump_path = None
         self.stores = []  # (addr, size, data)
         self.bbv = None
-        self.clpath = None
+        self.store = None  # PageStore taking the pages of the outputs
+
+    def load(self, lines: List[str], dirname: str):
+        dumpfile = None
+        for line in lines:
+            tokens = line.split()
+
+            if tokens[0] == 'begin':
+                self.entry_pc = int(tokens[1], 16)
+
+            elif tokens[0] in {'ireg', 'freg'}:
+                for val in tokens[1:]:
+                    reg = int(val, 16).to_bytes(8, 'little')
+                    self.regs.append(reg)
+
+            elif tokens[0] == 'syscall':
+                addr = int(tokens[1], 16)
+                if len(tokens) > 3 and tokens[3] == 'exit':
+                    syscall = SysCall(addr, is_break=True)
+                else:
+                    syscall = SysCall(addr, int(tokens[2], 16))
+                    if len(tokens) > 3:
+                        syscall.waddr = int(tokens[3], 16)
+                        syscall.set_wdata(tokens[4])
+                self.syscalls.append(syscall)
+
+            elif tokens[0] == 'break':
+                addr = int(tokens[1], 16)
+                if tokens[2] == 'repeat':
+                    repeat = int(tokens[3])
+                    rd = int(tokens[4])
+                    assert rd != 0
+                    self.breakpoint = (addr, rd, repeat)
+                else:
+                    syscal = SysCall(addr, is_break=True)
+                    self.syscalls.append(syscal)
+            elif tokens[0] == 'history':
+                self.history = []
+                for hist in tokens[1:]:
+                    syscalls, value = hist.split(':')
+                    self.history.append((int(syscalls), int(value, 16)))
+
+            elif tokens[0] == 'file':
+                self.dump_path = os.path.join(dirname, tokens[1])
+                self.path_prefix, _ = os.path.splitext(self.dump_path)
+            elif tokens[0] == 'page':
+                if dumpfile is None:
+                    dumpfile = DumpFile(self.dump_path)
+                self.load_page(dumpfile, int(tokens[1], 16))
+            elif tokens[0] == 'exec':
+                self.load_exec(dumpfile, int(tokens[1], 16))
+
+            elif tokens[0] == 'store':
+                addr = int(tokens[1], 16)
+                size = len(tokens[2]) // 2
+                data = int(tokens[2], 16)
+                self.stores.append((addr, size, data))
+
+            else:
+                raise KeyError(tokens[0])
+
+    def load_records(self, records, dirname: str):
+        # same as load, from (offset, type, payload) of a binary log
+        dumpfile = None
+        for _, rtype, payload in records:
+            if rtype == REC_BEGIN:
+                self.entry_pc, = struct.unpack_from('<Q', payload)
+                regs = bytes(payload[8:])
+                self.regs = [regs[i:i + 8] for i in range(0, len(regs), 8)]
+
+            elif rtype == REC_SYSCALL:
+                addr, retval = struct.unpack_from('<QQ', payload)
+                syscall = SysCall(addr, retval)
+                if len(payload) > 16:
+                    syscall.waddr, = struct.unpack_from('<Q', payload, 16)
+                    syscall.wdata = payload[24:]
+                self.syscalls.append(syscall)
+
+            elif rtype == REC_EXIT:
+                addr, _ = struct.unpack_from('<QQ', payload)
+                self.syscalls.append(SysCall(addr, is_break=True))
+
+            elif rtype == REC_BREAK:
+                addr, kind, rd, repeat = BinaryLog.BREAK.unpack(payload)
+                if BREAK_KINDS[kind] == 'repeat':
+                    assert rd != 0
+                    self.breakpoint = (addr, rd, repeat)
+                else:
+                    self.syscalls.append(SysCall(addr, is_break=True))
+            elif rtype == REC_HISTORY:
+                self.history = list(struct.iter_unpack('<QQ', payload))
+
+            elif rtype == REC_FILE:
+                path = str(payload, 'utf-8')
+                self.dump_path = os.path.join(dirname, path)
+                self.path_prefix, _ = os.path.splitext(self.dump_path)
+            elif rtype == REC_PAGES:
+                if dumpfile is None and len(payload):
+                    dumpfile = DumpFile(self.dump_path)
+                for pn, in struct.iter_unpack('<Q', payload):
+                    self.load_page(dumpfile, pn)
+            elif rtype == REC_EXECS:
+                for pn, in struct.iter_unpack('<Q', payload):
+                    self.load_exec(dumpfile, pn)
+
+            elif rtype == REC_STORE:
+                self.stores.append(struct.unpack('<QQQ', payload))
+
+            else:
+                raise KeyError(rtype)
+
+    def load_page(self, dumpfile: DumpFile, pn: int):
+        bitmap = dumpfile.read(PAGE_SIZE // 8)
+        data = dumpfile.read(PAGE_SIZE)
+        self.pages[pn] = Page(bitmap, data)
+
+    def load_exec(self, dumpfile: DumpFile, pn: int):
+        data = dumpfile.read(PAGE_SIZE * 2)
+        self.pages[pn].set_exec_count(data)
 
     def process_once(self, verbose=False, suffix='.1'):
         # reserve space for near/entry/far calls
-        for syscall in self.syscalls:
-            # set all 4 bytes in case the latter 2 bytes of
-            # an rvc instruction are considered free
-            self.pages.put(syscall.addr, b'\0' * 4)
-        free_list = self.pages.make_free_list()
+        with Profiler.stage('free_list'):
+            for syscall in self.syscalls:
+                # set all 4 bytes in case the latter 2 bytes of
+                # an rvc instruction are considered free
+                self.pages.put(syscall.addr, b'\0' * 4)
+            free_list = FreeList(self.pages.make_free_list())
         near_map = {}  # base_addr: near_addr
 
-        for syscall in self.syscalls:
-            if syscall.addr in near_map:
-                continue
-            size = len(MakeHelper.near(0, 0, 0, 0, syscall.alter_rd))
-            near_addr = self.pages.reserve(free_list, syscall.addr, size)
-            near_map[syscall.addr] = near_addr
+        with Profiler.stage('reserve'):
+            for syscall in self.syscalls:
+                if syscall.addr in near_map:
+                    continue
+                size = len(MakeHelper.near(0, 0, 0, 0, syscall.alter_rd))
+                near_addr = self.pages.reserve(free_list, syscall.addr, size)
+                near_map[syscall.addr] = near_addr
 
-        size = len(MakeHelper.near(0, 0, 0))
-        entry_addr = self.pages.reserve(free_list, self.entry_pc, size)
+            size = len(MakeHelper.near(0, 0, 0))
+            entry_addr = self.pages.reserve(free_list, self.entry_pc, size)
 
-        size = len(MakeHelper.far(0, 0))
-        far_addr = self.pages.reserve(free_list, self.entry_pc, size)
+            size = len(MakeHelper.far(0, 0))
+            far_addr = self.pages.reserve(free_list, self.entry_pc, size)
 
         # reserve pages for replay stack
         '''
@@ -402,22 +1492,23 @@ class Checkpoint:
         near_buf = replay_table_addr + len(replay_table)
 
         # write near/entry/far calls
-        for syscall in self.syscalls:
-            if syscall.addr not in near_map:
-                continue
-            near_addr = near_map.pop(syscall.addr)
-            trap = MakeHelper.jump(near_addr - syscall.addr)
-            near_call = MakeHelper.near(
-                syscall.addr + 4, near_addr, near_buf, far_addr,
-                syscall.alter_rd)
-            self.pages.put(syscall.addr, trap)
-            self.pages.put(near_addr, near_call)
+        with Profiler.stage('stubs'):
+            for syscall in self.syscalls:
+                if syscall.addr not in near_map:
+                    continue
+                near_addr = near_map.pop(syscall.addr)
+                trap = MakeHelper.jump(near_addr - syscall.addr)
+                near_call = MakeHelper.near(
+                    syscall.addr + 4, near_addr, near_buf, far_addr,
+                    syscall.alter_rd)
+                self.pages.put(syscall.addr, trap)
+                self.pages.put(near_addr, near_call)
 
-        entry_call = MakeHelper.near(self.entry_pc, entry_addr, near_buf)
-        self.pages.put(entry_addr, entry_call)
+            entry_call = MakeHelper.near(self.entry_pc, entry_addr, near_buf)
+            self.pages.put(entry_addr, entry_call)
 
-        far_call = MakeHelper.far(replay_sp_addr, replay_pc_addr)
-        self.pages.put(far_addr, far_call)
+            far_call = MakeHelper.far(replay_sp_addr, replay_pc_addr)
+            self.pages.put(far_addr, far_call)
 
         # write replay stack
         regs = self.regs.copy()
@@ -428,100 +1519,129 @@ class Checkpoint:
         self.pages.put(near_buf, self.regs[2])
 
         # dump pages and cfg
-        dumpfile = open(self.path_prefix + suffix + '.dump', 'wb')
-        cfgfile = open(self.path_prefix + suffix + '.cfg', 'w')
-        self.pages.dump(dumpfile, cfgfile)
-        dumpfile.close()
-        cfgfile.write('%x\n' % regs_addr)
-        cfgfile.close()
+        dumppath = self.path_prefix + suffix + self.dump_ext()
+        cfgpath = self.path_prefix + suffix + '.cfg'
+        with Profiler.stage('dump'), \
+                atomic_open(dumppath, 'wb') as dumpfile, \
+                atomic_open(cfgpath) as cfgfile:
+            self.pages.dump(dumpfile, cfgfile, self.store)
+            cfgfile.write('%x\n' % regs_addr)
 
     def process(self):
         # dump bbv
         if self.bbv is not None:
             bbvpath = self.path_prefix + '.bb'
-            with open(bbvpath, 'w') as f:
+            with Profiler.stage('dump_bbv'), atomic_open(bbvpath) as f:
                 self.pages.dump_bbv(self.bbv, f)
 
         # break with ecall or first-executed instruction
         if self.breakpoint is None:
             print(self.path_prefix, 'single pass')
             self.process_once()
-            self.verify()
+            print(self.path_prefix, 'done')
+            return
+
+        # break with a repeating instruction, whose executions have
+        # been recorded by rv-sim
+        if self.history is not None:
+            print(self.path_prefix, 'single pass with history')
+            self.syscalls = self.merge_history()
+            self.process_once(suffix='.2')
+            print(self.path_prefix, 'done')
             return
 
         # break with a repeating instruction
         print(self.path_prefix, 'first pass')
-        pages = copy.deepcopy(self.pages)
+        pages = self.pages.snapshot()
         self.process_once(verbose=True)
 
         # run the checkpoint and trace the execution of
         # the breakpoint instruction
         print(self.path_prefix, 'rerunning')
+        with Profiler.stage('rerun'):
+            new_syscalls = self.rerun()
+
+        # process again with the new syscall sequence
+        print(self.path_prefix, 'second pass')
+        self.syscalls = new_syscalls
+        self.pages.release()
+        self.pages = pages
+        self.process_once(suffix='.2')
+        print(self.path_prefix, 'done')
+
+    def merge_history(self) -> List[SysCall]:
+        # insert executions into the syscall sequence by the number
+        # of syscalls before each of them
         addr, rd, repeat = self.breakpoint
-        cmd = ['rv-sim', '-M', hex(addr), '--',
-               os.path.join(SRC_DIR, 'cl'),
-               self.path_prefix + '.1.cfg',
-               self.path_prefix + '.1.dump']
-        p = Popen(cmd, bufsize=8, stdout=PIPE, encoding='utf-8')
+        assert len(self.history) == repeat - 1, 'incomplete history'
+        new_syscalls = []
+        i = 0
+        for syscalls, value in self.history:
+            assert i <= syscalls <= len(self.syscalls), 'bad history'
+            new_syscalls += self.syscalls[i:syscalls]
+            i = syscalls
+            new_syscalls.append(SysCall(addr, value, alter_rd=rd))
+        new_syscalls += self.syscalls[i:]
+
+        # the last occurence is the breakpoint itself
+        new_syscalls.append(SysCall(addr, is_break=True))
+        return new_syscalls
+
+    def rerun(self) -> List[SysCall]:
+        # rv-sim stops by itself at the last execution of the breakpoint
+        addr, _, repeat = self.breakpoint
+        with self.standalone('.1') as dumppath:
+            cmd = ['rv-sim', '-M', hex(addr), '-L', str(repeat), '--',
+                   CL_PATH, self.path_prefix + '.1.cfg', dumppath]
+            p = Popen(cmd, stdout=PIPE)
+            Profiler.spawned()
+            try:
+                return self.merge_trace(p.stdout)
+            finally:
+                p.kill()
+                p.wait()
+
+    def merge_trace(self, f: io.BufferedReader) -> List[SysCall]:
+        # the trace starts after cl has loaded the checkpoint, which
+        # main.c and cl report by lines on the same stdout
         while True:
-            line = p.stdout.readline()
+            line = f.readline()
             if not line:
                 raise Exception('expected cl')
-            if line == 'invoke cl\n':
+            if line == b'begin execution\n':
                 break
 
-        # insert execution into the syscall sequence
+        # insert executions into the syscall sequence
+        addr, rd, repeat = self.breakpoint
         syscall_queue = list(reversed(self.syscalls))
         new_syscalls = []
         while True:
-            line = p.stdout.readline()
-            if not line:
+            rec = f.read(TRACE.size)
+            if len(rec) < TRACE.size:
                 raise Exception('incomplete execution')
-            if line.startswith('execute'):
-                val = int(line.split()[1], 16)
+            kind, val = TRACE.unpack(rec)
+            if kind == TRACE_STOP:
+                break
+            if kind == TRACE_EXECUTE:
                 syscall = SysCall(addr, val, alter_rd=rd)
                 new_syscalls.append(syscall)
                 repeat -= 1
-            elif line.startswith('syscall'):
-                val = int(line.split()[1], 16)
+            elif kind == TRACE_SYSCALL:
+                if not syscall_queue:
+                    raise Exception('unexpected syscall')
                 syscall = syscall_queue.pop()
                 assert val == syscall.retval
                 new_syscalls.append(syscall)
-            # omit the last occurence of the breakpoint, since this
-            # execution shouldn't happen, and may incur errors (e.g.
-            # loading from a new page)
-            if repeat == 1 and not syscall_queue:
-                syscall = SysCall(addr, is_break=True)
-                new_syscalls.append(syscall)
-                p.kill()
-                break
+            else:
+                raise Exception('unexpected trace %d' % kind)
 
-        # process again with the new syscall sequence
-        print(self.path_prefix, 'second pass')
-        self.syscalls = new_syscalls
-        self.pages = pages
-        self.process_once(suffix='.2')
-        self.verify('.2')
-
-    def verify(self, suffix='.1'):
-        if self.clpath is not None:
-            print(self.path_prefix, 'verifying')
-            cmd = ['spike', 'pk', self.clpath,
-                   self.path_prefix + suffix + '.cfg',
-                   self.path_prefix + suffix + '.dump']
-            p = Popen(cmd, stdin=DEVNULL, stdout=PIPE)
-            cause = b'\n'
-            while True:
-                line = p.stdout.readline()
-                if not line:
-                    break
-                cause = line
-            if p.wait():
-                cause = cause.decode('utf-8')[:-1]
-                info = '[%d] %s' % (p.returncode, cause)
-                print(self.path_prefix, info)
-                return
-        print(self.path_prefix, 'done')
+        # omit the last occurence of the breakpoint, since this
+        # execution shouldn't happen, and may incur errors (e.g.
+        # loading from a new page)
+        if repeat != 1 or syscall_queue:
+            raise Exception('incomplete execution')
+        new_syscalls.append(SysCall(addr, is_break=True))
+        return new_syscalls
 
     def make_replay_table(self, verbose: bool):
         buf = []
@@ -546,22 +1666,606 @@ class Checkpoint:
 
         return b''.join(buf)
 
-    def exists(self) -> bool:
-        if self.bbv is not None:
-            bbvpath = self.path_prefix + '.bb'
-            if not os.path.exists(bbvpath):
-                return False
+    def suffixes(self) -> List[str]:
+        # of the outputs, the last being the final one
         if self.breakpoint is None:
-            cfgpath = self.path_prefix + '.1.cfg'
-            dumppath = self.path_prefix + '.1.dump'
-        else:
-            cfgpath = self.path_prefix + '.2.cfg'
-            dumppath = self.path_prefix + '.2.dump'
-        return os.path.exists(cfgpath) and os.path.exists(dumppath)
+            return ['.1']
+        if self.history is not None:
+            return ['.2']
+        return ['.1', '.2']
+
+    def outputs(self) -> List[str]:
+        outputs = []
+        if self.bbv is not None:
+            outputs.append(self.path_prefix + '.bb')
+        for suffix in self.suffixes():
+            outputs.append(self.path_prefix + suffix + '.cfg')
+            outputs.append(self.path_prefix + suffix + self.dump_ext())
+        return outputs
+
+    def dump_ext(self) -> str:
+        return '.dump' if self.store is None else '.pages'
+
+    @contextlib.contextmanager
+    def standalone(self, suffix: str):
+        # yields the path of the dump of an output for cl, expanded
+        # from the page store into a private file if needed
+        if self.store is None:
+            yield self.path_prefix + suffix + '.dump'
+            return
+        with self.store.expanded(self.path_prefix + suffix + '.pages') \
+                as dumppath:
+            yield dumppath
 
 
-def main(logpath, execpath, rebuild, verify):
+class LogBlock:
+    '''
+    Records of a checkpoint in the log, from its begin record up to the
+    next one. The front end only locates blocks and reads their
+    history, break and file records, and each worker parses its own
+    block and loads its own dump.
+
+    After processing, a manifest of the inputs and outputs is written
+    next to the outputs. A block is stale, i.e. processed again, unless
+    its manifest matches the current inputs and all outputs are intact.
     '''
+    SOURCES = ['parse.py'] + StubCache.SOURCES
+    digests = {}  # of sources and cl, shared by all blocks
+
+    def __init__(self, logpath: str, begin: int, end: int,
+                 header: 'Checkpoint', binary: bool):
+        self.logpath = logpath
+        self.begin = begin
+        self.end = end
+        self.header = header  # only history, break and file are loaded
+        self.binary = binary
+        self.path_prefix = header.path_prefix
+
+    def cost(self) -> int:
+        # processing time mostly grows with the size of the dump
+        try:
+            return os.path.getsize(self.header.dump_path)
+        except OSError:
+            return 0
+
+    def manifest_path(self) -> str:
+        return self.path_prefix + '.manifest'
+
+    def digest_dump(self, manifest: dict = None) -> Tuple[str, list]:
+        # the hash in a manifest is trusted as long as the size and
+        # mtime of the dump are unchanged
+        st = os.stat(self.header.dump_path)
+        stat = [st.st_size, st.st_mtime_ns]
+        if manifest is not None and manifest['dump_stat'] == stat:
+            return manifest['inputs']['dump'], stat
+        return digest_file(self.header.dump_path), stat
+
+    def inputs(self, dump: str) -> dict:
+        with open(self.logpath, 'rb') as f:
+            f.seek(self.begin)
+            log = hashlib.sha256(f.read(self.end - self.begin)).hexdigest()
+
+        digests = LogBlock.digests
+        if 'sources' not in digests:
+            digests['sources'] = digest_sources(LogBlock.SOURCES).hex()
+        cl = None
+        if self.header.breakpoint is not None and \
+                self.header.history is None:
+            # the second pass follows a run of cl
+            if 'cl' not in digests:
+                digests['cl'] = digest_file(CL_PATH) \
+                    if os.path.exists(CL_PATH) else None
+            cl = digests['cl']
+
+        bbv = self.header.bbv
+        store = self.header.store
+        return {'version': MANIFEST_VERSION,
+                'log': log,
+                'dump': dump,
+                'sources': digests['sources'],
+                'cl': cl,
+                'bbv': bbv.sig if bbv is not None else None,
+                'store': store.path if store is not None else None}
+
+    def stale(self) -> bool:
+        try:
+            with open(self.manifest_path()) as f:
+                manifest = json.load(f)
+            dump, _ = self.digest_dump(manifest)
+            if self.inputs(dump) != manifest['inputs']:
+                return True
+            dirname = os.path.dirname(self.path_prefix)
+            names = [os.path.basename(p) for p in self.header.outputs()]
+            if sorted(manifest['outputs']) != sorted(names):
+                return True
+            for name, size in manifest['outputs'].items():
+                if os.path.getsize(os.path.join(dirname, name)) != size:
+                    return True
+        except (OSError, ValueError, KeyError, TypeError):
+            return True
+        return False
+
+    def load(self) -> 'Checkpoint':
+        ckpt = Checkpoint()
+        ckpt.bbv = self.header.bbv
+        ckpt.store = self.header.store
+        dirname = os.path.dirname(self.logpath)
+        if self.binary:
+            log = BinaryLog(self.logpath)
+            ckpt.load_records(log.records(self.begin, self.end), dirname)
+            return ckpt
+        with open(self.logpath, 'rb') as f:
+            f.seek(self.begin)
+            lines = f.read(self.end - self.begin).decode('utf-8')
+        ckpt.load(lines.splitlines(), dirname)
+        return ckpt
+
+    def process(self):
+        Profiler.checkpoint = os.path.basename(self.path_prefix)
+        with Profiler.stage('checkpoint'):
+            self.process_checkpoint()
+
+    def process_checkpoint(self):
+        with Profiler.stage('load'):
+            ckpt = self.load()
+        with Profiler.stage('digest'):
+            dump, stat = self.digest_dump()
+            inputs = self.inputs(dump)
+        try:
+            os.unlink(self.manifest_path())
+        except FileNotFoundError:
+            pass
+        ckpt.process()
+
+        outputs = {os.path.basename(path): os.path.getsize(path)
+                   for path in ckpt.outputs()}
+        with atomic_open(self.manifest_path()) as f:
+            json.dump({'inputs': inputs, 'dump_stat': stat,
+                       'outputs': outputs}, f, indent=1)
+
+
+def index_text_log(logpath: str):
+    # yields (begin, end, lines) with the history, break and file
+    # lines of each block, or None if it has no file line
+    with open(logpath, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # find begin lines
+    offs = [0] if buf[:6] == b'begin ' else []
+    pos = buf.find(b'\nbegin ')
+    while pos >= 0:
+        offs.append(pos + 1)
+        pos = buf.find(b'\nbegin ', pos + 1)
+    offs.append(len(buf))
+
+    for begin, end in zip(offs[:-1], offs[1:]):
+        # the break line, if any, comes right before the file line
+        file_pos = buf.find(b'\nfile ', begin, end) + 1
+        if not file_pos:
+            yield begin, end, None
+            continue
+        lines = [buf[file_pos:buf.find(b'\n', file_pos, end)]]
+        break_pos = buf.rfind(b'\nbreak ', begin, file_pos) + 1
+        if break_pos:
+            lines.insert(0, buf[break_pos:file_pos - 1])
+            # and the history line, if any, right before the break line
+            hist_pos = buf.rfind(b'\nhistory', begin, break_pos) + 1
+            if hist_pos:
+                lines.insert(0, buf[hist_pos:break_pos - 1])
+        yield begin, end, [line.decode('utf-8') for line in lines]
+
+    buf.close()
+
+
+def index_binary_log(logpath: str):
+    # same as index_text_log, with history, break and file records
+    log = BinaryLog(logpath)
+    begin, header = None, None
+    for offs, rtype, payload in log.records():
+        if rtype == REC_BEGIN:
+            if begin is not None:
+                yield begin, offs, header
+            begin, header = offs, []
+        elif rtype in {REC_HISTORY, REC_BREAK, REC_FILE}:
+            header.append((offs, rtype, payload))
+    if begin is not None:
+        yield begin, len(log.buf), header
+
+
+def index_log(logpath: str, bbv: BBVBase,
+              store: PageStore = None) -> List[LogBlock]:
+    binary = BinaryLog.is_binary(logpath)
+    dirname = os.path.dirname(logpath)
+    blocks = []
+    index = index_binary_log if binary else index_text_log
+    for begin, end, header_records in index(logpath):
+        header = Checkpoint()
+        header.bbv = bbv
+        header.store = store
+        if binary:
+            header.load_records(header_records, dirname)
+        elif header_records is not None:
+            header.load(header_records, dirname)
+        if header.path_prefix is None:
+            print('%s: no file in checkpoint at %d' % (logpath, begin))
+            continue
+        blocks.append(LogBlock(logpath, begin, end, header, binary))
+    return blocks
+
+
+def convert_log(textpath: str, binpath: str):
+    '''
+    Converts a text log to the binary log rv-sim writes with -B.
+    '''
+    def put(rtype: int, *payload: bytes):
+        size = sum(len(p) for p in payload)
+        out.write(BinaryLog.RECORD.pack(rtype, size))
+        out.write(b''.join(payload))
+        out.write(bytes(-size & 7))
+
+    def flush_pns():
+        if pns is not None:
+            put(REC_PAGES, struct.pack('<%dQ' % len(pns[0]), *pns[0]))
+            put(REC_EXECS, struct.pack('<%dQ' % len(pns[1]), *pns[1]))
+
+    pns = None  # pages and execs after the current file line
+    with open(textpath) as f, open(binpath, 'wb') as out:
+        out.write(BinaryLog.HEADER.pack(LOG_MAGIC, LOG_VERSION, 0))
+        for line in f:
+            tokens = line.split()
+            if tokens[0] in {'page', 'exec'}:
+                pns[tokens[0] == 'exec'].append(int(tokens[1], 16))
+                continue
+            flush_pns()
+            pns = None
+
+            if tokens[0] == 'begin':
+                regs = [int(tokens[1], 16)]
+            elif tokens[0] in {'ireg', 'freg'}:
+                regs += [int(val, 16) for val in tokens[1:]]
+                if tokens[0] == 'freg':
+                    put(REC_BEGIN, struct.pack('<65Q', *regs))
+            elif tokens[0] == 'syscall' and tokens[3:4] == ['exit']:
+                put(REC_EXIT, struct.pack(
+                    '<QQ', int(tokens[1], 16), int(tokens[2], 16)))
+            elif tokens[0] == 'syscall':
+                rec = [int(val, 16) for val in tokens[1:4]]
+                wdata = bytes.fromhex(tokens[4]) if len(tokens) > 4 else b''
+                put(REC_SYSCALL, struct.pack('<%dQ' % len(rec), *rec), wdata)
+            elif tokens[0] == 'history':
+                hists = [int(v, 16 if i % 2 else 10) for hist in tokens[1:]
+                         for i, v in enumerate(hist.split(':'))]
+                put(REC_HISTORY, struct.pack('<%dQ' % len(hists), *hists))
+            elif tokens[0] == 'break':
+                kind = BREAK_KINDS.index(tokens[2])
+                times, rd = map(int, tokens[3:5]) if kind == 3 else (0, 0)
+                put(REC_BREAK, BinaryLog.BREAK.pack(
+                    int(tokens[1], 16), kind, rd, times))
+            elif tokens[0] == 'file':
+                put(REC_FILE, tokens[1].encode('utf-8'))
+                pns = ([], [])
+            elif tokens[0] == 'store':
+                put(REC_STORE, struct.pack('<QQQ', int(tokens[1], 16),
+                                           len(tokens[2]) // 2,
+                                           int(tokens[2], 16)))
+            else:
+                raise KeyError(tokens[0])
+        flush_pns()
+
+
+def export_log(logpath: str, store: PageStore, outdir: str):
+    # write standalone cfg and dump pairs of all the processed outputs
+    # in the log, e.g. for copying them elsewhere
+    os.makedirs(outdir, exist_ok=True)
+    count = 0
+    for block in index_log(logpath, None, store):
+        for path in block.header.outputs():
+            if not path.endswith('.pages'):
+                continue
+            if not os.path.exists(path):
+                print(block.path_prefix, 'not processed')
+                continue
+            prefix = path[:-len('.pages')]
+            name = os.path.basename(prefix)
+            shutil.copyfile(prefix + '.cfg',
+                            os.path.join(outdir, name + '.cfg'))
+            store.export(path, os.path.join(outdir, name + '.dump'))
+            count += 1
+    print('%d exported to %s' % (count, outdir))
+
+
+class Scheduler:
+    '''
+    Processes checkpoints in forked workers, the most costly first.
+    A failed checkpoint is retried and then reported without affecting
+    the others.
+    '''
+
+    def __init__(self, jobs: int, retries: int):
+        self.jobs = jobs
+        self.retries = retries
+        self.pending = []  # heap of (-cost, seq, task, attempt)
+        self.running = {}  # pid: (task, attempt, begin_time)
+        self.results = []  # dict for each task
+        self.seq = 0
+
+    def submit(self, task: LogBlock, attempt: int = 1):
+        heapq.heappush(self.pending, (-task.cost(), self.seq, task, attempt))
+        self.seq += 1
+
+    @staticmethod
+    def run(task: LogBlock) -> int:
+        try:
+            task.process()
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+        return 0
+
+    def dispatch(self):
+        while self.pending and len(self.running) < self.jobs:
+            _, _, task, attempt = heapq.heappop(self.pending)
+
+            # no multiprocessing
+            if self.jobs < 2:
+                begin_time = time.time()
+                self.retire(task, attempt, self.run(task), begin_time)
+                continue
+
+            # catch up with the page store once for all workers, who
+            # then only read the digests appended since
+            if task.header.store is not None:
+                task.header.store.refresh()
+
+            pid = os.fork()
+            if pid != 0:
+                self.running[pid] = (task, attempt, time.time())
+                Profiler.pids.append(pid)
+                continue
+            status = 1
+            try:
+                MakeHelper.identifier = os.getpid().to_bytes(4, 'little')
+                Profiler.fork(os.path.basename(task.path_prefix))
+                status = self.run(task)
+            finally:
+                try:
+                    # also the stages of a failed run
+                    Profiler.save_part()
+                finally:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    os._exit(status & 0xff)
+
+    def retire(self, task: LogBlock, attempt: int, status: int,
+               begin_time: float):
+        if status and attempt <= self.retries:
+            print(task.path_prefix, 'failed with %d, retrying' % status)
+            self.submit(task, attempt + 1)
+            return
+        if status:
+            print(task.path_prefix, 'failed with %d' % status)
+        self.results.append({
+            'checkpoint': task.path_prefix,
+            'status': 'done' if status == 0 else 'failed',
+            'returncode': status,
+            'attempts': attempt,
+            'cost': task.cost(),
+            'seconds': round(time.time() - begin_time, 3)})
+
+    def finish(self) -> List[dict]:
+        self.dispatch()
+        while self.running:
+            pid, status = os.wait()
+            task, attempt, begin_time = self.running.pop(pid)
+            status = os.waitstatus_to_exitcode(status)
+            self.retire(task, attempt, status, begin_time)
+            self.dispatch()
+        return self.results
+
+
+class Verifier:
+    '''
+    Runs outputs on spike, a bounded number at once, stopping each run
+    past a time or instruction budget. Results are cached by the hashes
+    of cl and the outputs, so an unchanged output is never run again.
+
+    Runs start only after the workers of Scheduler have exited, as its
+    os.wait() would otherwise reap spike. Spike runs in its own session,
+    out of reach of Ctrl-C, so verify_all kills the live runs itself.
+    '''
+
+    def __init__(self, clpath: str, jobs: int, timeout: float = None,
+                 max_insns: int = None, cache: StubCache = None,
+                 store: PageStore = None):
+        self.clpath = clpath
+        self.jobs = jobs
+        self.timeout = timeout or None
+        self.max_insns = max_insns
+        self.cache = cache
+        self.store = store
+        # without cl every output fails to verify, as spike would
+        self.salt = None
+        if os.path.exists(clpath):
+            self.salt = '\t'.join([digest_file(clpath), str(self.timeout),
+                                   str(max_insns)])
+        self.procs = set()  # live spike runs
+        self.lock = threading.Lock()
+        self.stopping = False
+
+    def key(self, cfgpath: str, dumppath: str) -> str:
+        # a .pages names pages of the store, which never change
+        sig = '\t'.join([self.salt, digest_file(cfgpath),
+                         digest_file(dumppath)])
+        if dumppath.endswith('.pages'):
+            sig += '\t' + self.store.path
+        return hashlib.sha256(sig.encode('utf-8')).hexdigest()
+
+    @contextlib.contextmanager
+    def standalone(self, dumppath: str):
+        if not dumppath.endswith('.pages'):
+            yield dumppath
+            return
+        with self.store.expanded(dumppath) as path:
+            yield path
+
+    def run(self, cfgpath: str, dumppath: str) -> dict:
+        cmd = ['spike']
+        if self.max_insns:
+            cmd.append('--instructions=%d' % self.max_insns)
+        begin_time = time.time()
+        with self.standalone(dumppath) as path:
+            cmd += ['pk', self.clpath, cfgpath, path]
+            # in its own group, so that killing it leaves nothing
+            # holding the pipe
+            p = Popen(cmd, stdin=DEVNULL, stdout=PIPE,
+                      start_new_session=True)
+            Profiler.spawned()
+            with self.lock:
+                self.procs.add(p)
+                if self.stopping:  # started while verify_all was stopping
+                    os.killpg(p.pid, signal.SIGKILL)
+            try:
+                out, _ = p.communicate(timeout=self.timeout)
+                timed_out = False
+            except TimeoutExpired:
+                os.killpg(p.pid, signal.SIGKILL)
+                out, _ = p.communicate()
+                timed_out = True
+            finally:
+                with self.lock:
+                    self.procs.discard(p)
+
+        # cl prints the counters at the end of a run
+        result = {'returncode': p.returncode, 'cause': '',
+                  'cycle': None, 'instret': None}
+        for line in out.decode('utf-8', 'replace').splitlines():
+            name, _, value = line.partition(' ')
+            if name in ('cycle', 'instret'):
+                result[name] = int(value, 16)
+            elif line:
+                result['cause'] = line
+        if timed_out:
+            result['cause'] = 'timed out after %gs' % self.timeout
+        elif not p.returncode and result['instret'] is None:
+            result['cause'] = 'stopped after %d instructions' % \
+                self.max_insns if self.max_insns else 'unfinished'
+        result['passed'] = not timed_out and not p.returncode and \
+            result['instret'] is not None
+        if result['passed']:
+            result['cause'] = ''
+        result['seconds'] = round(time.time() - begin_time, 3)
+        result['timed_out'] = timed_out
+        return result
+
+    def verify_cached(self, name: str, cfgpath: str, dumppath: str) -> dict:
+        key = self.key(cfgpath, dumppath)
+        data = self.cache.get(key) if self.cache is not None else None
+        if data is not None:
+            result = json.loads(data)
+            result['cached'] = True
+        else:
+            with Profiler.stage('verify', os.path.basename(name)):
+                result = self.run(cfgpath, dumppath)
+            # a timeout depends on the load of the host, and a run
+            # killed by verify_all says nothing about the output
+            if self.cache is not None and not result['timed_out'] and \
+                    not self.stopping:
+                self.cache.put(key, json.dumps(result).encode('utf-8'))
+            result['cached'] = False
+        return result
+
+    def verify(self, name: str, cfgpath: str, dumppath: str) -> dict:
+        if self.salt is None:
+            result = {'returncode': None,
+                      'cause': '%s not built' % self.clpath,
+                      'cycle': None, 'instret': None, 'passed': False,
+                      'seconds': 0, 'timed_out': False, 'cached': False}
+        else:
+            result = self.verify_cached(name, cfgpath, dumppath)
+        result['checkpoint'] = name
+        if result['passed']:
+            print(name, 'verified')
+        else:
+            print(name, '[%s] %s' % (result['returncode'], result['cause']))
+        return result
+
+    def verify_all(self, outputs: List[Tuple[str, str, str]]) -> List[dict]:
+        # (name, cfgpath, dumppath) of each output
+        pool = ThreadPoolExecutor(self.jobs)
+        try:
+            results = list(pool.map(lambda output: self.verify(*output),
+                                    outputs))
+        except BaseException:
+            # e.g. Ctrl-C: stop the queued runs and kill the live ones,
+            # so that shutting down the pool does not wait for them
+            with self.lock:
+                self.stopping = True
+                for p in self.procs:
+                    try:
+                        os.killpg(p.pid, signal.SIGKILL)
+                    except ProcessLookupError:  # exited meanwhile
+                        pass
+            pool.shutdown(cancel_futures=True)
+            raise
+        pool.shutdown()
+        return results
+
+
+def check_encoder() -> bool:
+    addrs = [(0, 0), (0x7f8, 0x800), (0x12ff8, 0x3456a),
+             (0x7ffff7f8, 0x7fffeffe)]
+    cases = []  # (func, args)
+    for offset in [-J_MAX_OFFS, -J_MAX_OFFS + 2, -2050, -2048, -2046,
+                   -2, 0, 2, 2046, 2048, J_MAX_OFFS - 2]:
+        cases.append((MakeHelper.jump, (offset,)))
+    for alter_rd in [None, 1, 2, 5, 10, 31]:
+        for near_buf, far_pc in addrs:
+            cases.append((MakeHelper.near,
+                          (0x10000, 0x10f00, near_buf, far_pc, alter_rd)))
+        cases.append((MakeHelper.near, (0x20000, 0x10000, 0x12ff8)))
+    for replay_sp, replay_pc in addrs:
+        cases.append((MakeHelper.far, (replay_sp, replay_pc)))
+
+    passed = True
+    for func, func_args in cases:
+        MakeHelper.toolchain = True
+        expected = func(*func_args)
+        MakeHelper.toolchain = False
+        encoded = func(*func_args)
+        if encoded != expected:
+            print('mismatch: %s%r' % (func.__name__, func_args))
+            print('  make:    %s' % expected.hex())
+            print('  encoder: %s' % encoded.hex())
+            passed = False
+    print('checked %d stubs: %s' % (
+        len(cases), 'passed' if passed else 'failed'))
+    return passed
+
+
+def check_decoder(path: str) -> bool:
+    decoded = BBVBase.decode(path)
+    expected = BBVBase.disassemble(path)
+    passed = np.array_equal(decoded, expected)
+    if not passed:
+        decoded, expected = set(decoded.tolist()), set(expected.tolist())
+        for pc in sorted(decoded - expected)[:16]:
+            print('only decoded: %x' % pc)
+        for pc in sorted(expected - decoded)[:16]:
+            print('only in objdump: %x' % pc)
+    print('checked %d cfis: %s' % (
+        len(expected), 'passed' if passed else 'failed'))
+    return passed
+
+
+def main(args) -> int:
+    '''
+    Processes the log at args.path with the options of parser, and
+    returns the number of failed checkpoints.
+
     Log types:
         begin <addr>
         ireg <val0> ... <val31>
@@ -570,130 +2274,116 @@ def main(logpath, execpath, rebuild, verify):
         syscall <addr> <retval> exit
         break <addr> {ecall|first|firstrvc}
         break <addr> repeat <times> <rd>
+        history <syscalls>:<value> ...
         file <path>
         page <pn>
         exec <pn>
+        store <addr> <data>
+    A log may also be in the binary format, see BinaryLog.
     '''
-    f = open(logpath)
-    dirname = os.path.dirname(logpath)
-    cur = None
-    dumpfile = None
-    children = set()  # pid
-    bbv = BBVBase(execpath) if execpath else None
-    clpath = os.path.join(SRC_DIR, 'cl') if verify else None
-
-    def submit_task():
-        if cur is None:
-            return
-        dumpfile.close()  # close it as soon as possible
-
-        # no multiprocessing
-        if args.jobs < 2:
-            cur.process()
-            return
-
-        # block main if parallel jobs reach limitation
-        if len(children) == args.jobs:
-            pid, status = os.wait()
-            children.remove(pid)
-            if status:
-                while children:
-                    children.remove(os.wait()[0])
-                exit(-1)
-
-        # do fork
-        pid = os.fork()
-        if pid != 0:
-            children.add(pid)
-            return
-        f.close()
-        MakeHelper.identifier = os.getpid().to_bytes(4, 'little')
-        cur.process()
-        exit(0)
-
-    while True:
-        line = f.readline()
-        if not line:
-            submit_task()
-            break
-        tokens = line.split()
-
-        if tokens[0] == 'begin':
-            submit_task()
-            cur = Checkpoint()
-            cur.entry_pc = int(tokens[1], 16)
-            cur.bbv = bbv
-            cur.clpath = clpath
-
-        elif tokens[0] in {'ireg', 'freg'}:
-            for val in tokens[1:]:
-                reg = int(val, 16).to_bytes(8, 'little')
-                cur.regs.append(reg)
-
-        elif tokens[0] == 'syscall':
-            addr = int(tokens[1], 16)
-            if len(tokens) > 3 and tokens[3] == 'exit':
-                syscall = SysCall(addr, is_break=True)
-            else:
-                syscall = SysCall(addr, int(tokens[2], 16))
-                if len(tokens) > 3:
-                    syscall.waddr = int(tokens[3], 16)
-                    syscall.set_wdata(tokens[4])
-            cur.syscalls.append(syscall)
-
-        elif tokens[0] == 'break':
-            addr = int(tokens[1], 16)
-            if tokens[2] == 'repeat':
-                repeat = int(tokens[3])
-                rd = int(tokens[4])
-                assert rd != 0
-                cur.breakpoint = (addr, rd, repeat)
-            else:
-                syscal = SysCall(addr, is_break=True)
-                cur.syscalls.append(syscal)
-
-        elif tokens[0] == 'file':
-            path = os.path.join(dirname, tokens[1])
-            cur.path_prefix, _ = os.path.splitext(path)
-            if rebuild or not cur.exists():
-                dumpfile = open(path, 'rb')
-            else:
-                cur = None
-        elif tokens[0] == 'page':
-            if cur is not None:
-                bitmap = dumpfile.read(PAGE_SIZE // 8)
-                data = dumpfile.read(PAGE_SIZE)
-                pn = int(tokens[1], 16)
-                cur.pages[pn] = Page(bitmap, data)
-        elif tokens[0] == 'exec':
-            if cur is not None:
-                data = dumpfile.read(PAGE_SIZE * 2)
-                pn = int(tokens[1], 16)
-                cur.pages[pn].set_exec_count(data)
-
-        elif tokens[0] == 'store':
-            if cur is not None:
-                addr = int(tokens[1], 16)
-                size = len(tokens[2]) // 2
-                data = int(tokens[2], 16)
-                cur.stores.append((addr, size, data))
-
+    logpath, execpath = args.path, args.exec
+    tracepath = None
+    if args.profile is not None:
+        tracepath = os.path.abspath(
+            args.profile or os.path.splitext(logpath)[0] + '.trace.json')
+    Profiler.reset(tracepath)
+    scheduler = Scheduler(args.jobs, args.retries)
+    bbv = None
+    if execpath:
+        with Profiler.stage('disassemble'):
+            bbv = BBVBase(execpath, args.cache_dir)
+    store = PageStore(args.store) if args.store else None
+    # stubs are only built, and so cached, with the toolchain
+    MakeHelper.cache = None
+    if MakeHelper.toolchain and args.cache_size > 0:
+        MakeHelper.cache = StubCache(args.cache_dir, args.cache_size << 20)
+
+    up_to_date = 0
+    with Profiler.stage('index'):
+        blocks = index_log(logpath, bbv, store)
+    for block in blocks:
+        if args.rebuild:
+            scheduler.submit(block)
+            continue
+        with Profiler.stage('stale', os.path.basename(block.path_prefix)):
+            stale = block.stale()
+        if stale:
+            scheduler.submit(block)
         else:
-            raise KeyError(tokens[0])
-
-    f.close()
-    while children:
-        pid, status = os.wait()
-        children.remove(pid)
-        if status:
-            while children:
-                children.remove(os.wait()[0])
-            exit(-1)
+            up_to_date += 1
+    results = scheduler.finish()
+    if MakeHelper.cache is not None:
+        MakeHelper.cache.trim()
+
+    # verify the final output of each checkpoint processed so far
+    verified = []
+    if args.verify:
+        failed = {r['checkpoint'] for r in results if r['status'] != 'done'}
+        outputs = []
+        for block in blocks:
+            name = block.path_prefix + block.header.suffixes()[-1]
+            dumppath = name + block.header.dump_ext()
+            if block.path_prefix not in failed and os.path.exists(dumppath):
+                outputs.append((block.path_prefix, name + '.cfg', dumppath))
+        cache = None
+        if args.cache_size > 0:
+            cache = StubCache(os.path.join(args.cache_dir, 'verify'),
+                              args.cache_size << 20)
+        verifier = Verifier(CL_PATH,
+                            args.verify_jobs or args.jobs,
+                            args.verify_timeout, args.verify_insns,
+                            cache, store)
+        verified = verifier.verify_all(outputs)
+        if cache is not None:
+            cache.trim()
+
+    # write summary
+    failed = [r for r in results if r['status'] != 'done']
+    unverified = [r for r in verified if not r['passed']]
+    summary = {'log': logpath, 'done': len(results) - len(failed),
+               'failed': len(failed), 'up_to_date': up_to_date,
+               'checkpoints': results}
+    if args.verify:
+        summary.update({'verified': len(verified) - len(unverified),
+                        'verify_failed': len(unverified),
+                        'verifications': verified})
+    summarypath = args.summary or os.path.splitext(logpath)[0] + '.json'
+    with atomic_open(summarypath) as f:
+        json.dump(summary, f, indent=1)
+    if args.verify:
+        print('%d verified, %d failed to verify' % (
+            summary['verified'], summary['verify_failed']))
+    print('%d done, %d failed, %d up to date, summary written to %s' % (
+        summary['done'], summary['failed'], up_to_date, summarypath))
+    if Profiler.path is not None:
+        Profiler.save()
+        Profiler.report()
+        print('trace written to %s' % Profiler.path)
+    return len(failed)
 
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    if args.check_encoder:
+        if args.cache_size > 0:
+            MakeHelper.cache = StubCache(args.cache_dir, args.cache_size << 20)
+        exit(0 if check_encoder() else 1)
+    if args.check_decoder:
+        if args.exec is None:
+            parser.error('--check-decoder requires --exec')
+        exit(0 if check_decoder(args.exec) else 1)
+    if args.path is None:
+        parser.error('the following arguments are required: path')
+    if args.convert:
+        convert_log(args.path, args.convert)
+        exit(0)
+    if args.export:
+        if args.store is None:
+            parser.error('--export requires --store')
+        export_log(args.path, PageStore(args.store), args.export)
+        exit(0)
     try:
-        main(args.path, args.exec, args.rebuild, args.verify)
+        if main(args):
+            exit(1)
     except KeyboardInterrupt:
         pass
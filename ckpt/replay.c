@@ -76,9 +76,10 @@ replay_cfg *replay(replay_cfg *head, uint64_t csrv[NUM_CSR])
         }
     }
 
-end_verbose:
-    RAW_PRINT("syscall ");
-    raw_log_u64(head->size);
+end_verbose: {
+    uint64_t trace[2] = {TRACE_SYSCALL, head->size};
+    raw_write(1, trace, sizeof(trace));
+}
 
 end:
     // return with the address of next entry
@@ -7,6 +7,11 @@
 #define REPLAY_ENTRY 2
 #define REPLAY_RET_VERBOSE 3
 
+// monitor trace records, see CheckpointManager in rv-sim
+#define TRACE_EXECUTE 1
+#define TRACE_SYSCALL 2
+#define TRACE_STOP 3
+
 typedef struct {
     uint64_t addr;
     uint64_t size;
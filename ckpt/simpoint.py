@@ -0,0 +1,149 @@
+'''
+SimPoint analysis of the .bb files written by parse.py --exec, after
+SimPoint 3.0: the vectors are normalized, randomly projected to a few
+dimensions and clustered by k-means for each k up to max_k, and the
+smallest k whose BIC is close enough to the best is picked.
+'''
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+CHUNK = 1 << 22  # nonzeros projected at a time
+
+
+def load_bbvs(paths: List[str]) -> Tuple[np.ndarray, ...]:
+    # the vector of each file as a sparse matrix in csr form of
+    # (indptr, cols, counts), with the 1-based cfi indexes as cols
+    pairs = []
+    for path in paths:
+        with open(path) as f:
+            line = f.read().strip()
+        assert line.startswith('T'), 'Bad bbv in %s' % path
+        pairs.append(np.fromstring(line[1:].replace(':', ' '),
+                                   dtype=np.int64, sep=' '))
+    indptr = np.zeros(len(paths) + 1, dtype=np.int64)
+    np.cumsum([len(pair) // 2 for pair in pairs], out=indptr[1:])
+    pairs = np.concatenate(pairs) if pairs else np.empty(0, np.int64)
+    return indptr, pairs[0::2], pairs[1::2].astype(np.float64)
+
+
+def project(indptr: np.ndarray, cols: np.ndarray, counts: np.ndarray,
+            dim: int, seed: int) -> np.ndarray:
+    # normalize each vector to frequencies, then multiply the sparse
+    # matrix by a random one of [-1, 1), a column at a time as gathering
+    # from a column keeps in cache
+    rng = np.random.default_rng(seed)
+    matrix = rng.uniform(-1, 1, (int(cols.max(initial=0)) + 1, dim)).T.copy()
+
+    num_rows = len(indptr) - 1
+    data = np.zeros((num_rows, dim))
+    begin = 0
+    while begin < num_rows:
+        end = np.searchsorted(indptr, indptr[begin] + CHUNK, 'right') - 1
+        end = max(end, begin + 1)
+        nonempty = np.diff(indptr[begin:end + 1]) > 0
+        begin, end = int(begin), int(end)
+        if nonempty.any():
+            chunk = slice(indptr[begin], indptr[end])
+            starts = indptr[begin:end][nonempty] - indptr[begin]
+            totals = np.add.reduceat(counts[chunk], starts)
+            rows = np.flatnonzero(nonempty) + begin
+            for d in range(dim):
+                part = counts[chunk] * matrix[d][cols[chunk]]
+                data[rows, d] = np.add.reduceat(part, starts) / totals
+        begin = end
+    return data
+
+
+def kmeans(data: np.ndarray, k: int, seed: tuple,
+           iters: int) -> Tuple[np.ndarray, np.ndarray, float]:
+    # returns labels, centers and the sum of squared distances, with
+    # centers initialized as by k-means++, as sampling points uniformly
+    # often leaves two centers in one phase for good
+    rng = np.random.default_rng(seed)
+    centers = np.empty((k, data.shape[1]))
+    centers[0] = data[rng.integers(len(data))]
+    nearest = ((data - centers[0]) ** 2).sum(1)
+    for i in range(1, k):
+        total = nearest.sum()
+        if total > 0:
+            centers[i] = data[rng.choice(len(data), p=nearest / total)]
+        else:  # fewer distinct points than k
+            centers[i] = data[rng.integers(len(data))]
+        nearest = np.minimum(nearest, ((data - centers[i]) ** 2).sum(1))
+    labels = None
+    for _ in range(iters):
+        # squared distances less the norms of the points, which do not
+        # change the nearest center
+        dists = (centers * centers).sum(1) - 2 * data @ centers.T
+        new_labels = dists.argmin(1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sizes = np.bincount(labels, minlength=k)
+        dim = data.shape[1]
+        sums = np.bincount((labels[:, None] * dim + np.arange(dim)).ravel(),
+                           weights=data.ravel(), minlength=k * dim)
+        # an emptied cluster keeps its center
+        nonempty = sizes > 0
+        centers[nonempty] = sums.reshape(k, dim)[nonempty] / \
+            sizes[nonempty, None]
+    sse = float(((data - centers[labels]) ** 2).sum())
+    return labels, centers, sse
+
+
+def bic(data: np.ndarray, labels: np.ndarray, k: int, sse: float) -> float:
+    # of spherical gaussians with a shared variance, as in x-means
+    num, dim = data.shape
+    sizes = np.bincount(labels, minlength=k).astype(np.float64)
+    sizes = sizes[sizes > 0]
+    variance = max(sse / max(num - k, 1), 1e-300)
+    likelihood = (sizes * np.log(sizes) - sizes * math.log(num)
+                  - sizes / 2 * math.log(2 * math.pi)
+                  - sizes * dim / 2 * math.log(variance)
+                  - (sizes - k) / 2).sum()
+    params = (k - 1) + dim * k + 1
+    return likelihood - params / 2 * math.log(num)
+
+
+def simpoints(paths: List[str], max_k: int, dim: int = 15, seeds: int = 5,
+              iters: int = 100, bic_threshold: float = 0.9,
+              seed: int = 0, jobs: int = 1) -> List[Tuple[int, int, float]]:
+    '''
+    Clusters the intervals of the .bb files, in order. Returns
+    (interval, cluster, weight) of the interval closest to the center
+    of each cluster, by cluster.
+    '''
+    data = project(*load_bbvs(paths), dim, seed)
+    max_k = min(max_k, len(paths))
+
+    # the best of the seeds for each k, all run in parallel as numpy
+    # releases the GIL
+    tasks = [(k, s) for k in range(1, max_k + 1) for s in range(seeds)]
+    with ThreadPoolExecutor(jobs) as pool:
+        runs = list(pool.map(
+            lambda task: kmeans(data, task[0], (seed,) + task, iters),
+            tasks))
+    best = {}
+    for (k, _), run in zip(tasks, runs):
+        if k not in best or run[2] < best[k][2]:
+            best[k] = run
+
+    scores = {k: bic(data, labels, k, sse)
+              for k, (labels, _, sse) in best.items()}
+    low, high = min(scores.values()), max(scores.values())
+    k = min(k for k, score in scores.items()
+            if score >= low + bic_threshold * (high - low))
+
+    labels, centers, _ = best[k]
+    result = []
+    for cluster in range(k):
+        members = np.flatnonzero(labels == cluster)
+        if not len(members):
+            continue
+        dists = ((data[members] - centers[cluster]) ** 2).sum(1)
+        interval = int(members[dists.argmin()])
+        result.append((interval, len(result), len(members) / len(paths)))
+    return result
@@ -132,6 +132,8 @@ struct rv_emulator
 	std::string checkpoint_filename;
 	uint64_t checkpoint_period = 0x7fffffffffffffffULL;
 	std::string checkpoint_monitor;
+	uint64_t checkpoint_monitor_limit = 0;
+	bool checkpoint_binary = false;
 	std::string elf_filename;
 	std::string stats_dirname;
 
@@ -192,9 +194,15 @@ struct rv_emulator
 			{ "-V", "--checkpoint-period", cmdline_arg_type_string,
 				"Take checkpoints at this period of instructions",
 				[&](std::string s) { checkpoint_period = strtoull(s.c_str(), nullptr, 10); return true; } },
+			{ "-B", "--checkpoint-binary", cmdline_arg_type_none,
+				"Dump checkpoints in the binary log format",
+				[&](std::string s) { return (checkpoint_binary = true); } },
 			{ "-M", "--checkpoint-monitor", cmdline_arg_type_string,
 				"Monitor every execution of the instruction at this pc",
 				[&](std::string s) { checkpoint_monitor = s; return true; } },
+			{ "-L", "--checkpoint-monitor-limit", cmdline_arg_type_string,
+				"Stop at this execution of the monitored instruction",
+				[&](std::string s) { checkpoint_monitor_limit = strtoull(s.c_str(), nullptr, 10); return true; } },
 			{ "-h", "--help", cmdline_arg_type_none,
 				"Show help",
 				[&](std::string s) { return (help_or_error = true); } },
@@ -246,13 +254,8 @@ struct rv_emulator
 		/* open checkpoint file */
 		if (!checkpoint_filename.empty()) {
 			char *path = strdup(checkpoint_filename.c_str());
-			FILE *fout = fopen(path, "w");
-			if (fout == NULL) {
-				fprintf(stderr, "%s: %s\n", path, strerror(errno));
-				exit(-1);
-			}
-			checkpoint.out = fout;
-			checkpoint.period = checkpoint_period;
+			checkpoint.open(path, checkpoint_binary);
+			checkpoint.set_period(checkpoint_period);
 			checkpoint.dirname = dirname(path);
 		}
 
@@ -264,6 +267,7 @@ struct rv_emulator
 			} else {
 				checkpoint.monitor_pc = strtoull(str, nullptr, 10);
 			}
+			checkpoint.monitor_limit = checkpoint_monitor_limit;
 		}
 
 		/* randomise integer register state with 512 bits of entropy */
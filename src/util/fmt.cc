@@ -44,6 +44,8 @@
  * SUCH DAMAGE.
  */
 
+#include <unistd.h>
+
 #include "fmt.h"
 
 using namespace riscv;
@@ -630,8 +632,109 @@ void MemTrace::dump(FILE *dump_file, FILE *cfg_file)
 	}
 }
 
+void MemTrace::dump(FILE *dump_file, std::vector<uint64_t> &page_pns,
+	std::vector<uint64_t> &exec_pns)
+{
+	for (auto &page : pages) {
+		fwrite(page.second, sizeof(PageRec), 1, dump_file);
+		page_pns.push_back(page.first);
+	}
+	for (auto &exec : execs) {
+		fwrite(exec.second, sizeof(ExecRec), 1, dump_file);
+		exec_pns.push_back(exec.first);
+	}
+}
+
 CheckpointManager riscv::checkpoint = {};
 
+void CheckpointManager::open(const char *path, bool binary)
+{
+	out = fopen(path, binary ? "wb" : "w");
+	if (out == NULL) {
+		fprintf(stderr, "%s: %s\n", path, strerror(errno));
+		::exit(-1);
+	}
+	this->binary = binary;
+	if (binary) {
+		static const char magic[8] = { 'R', 'V', '8', 'C', 'K', 'P', 'T', 0 };
+		uint32_t version[2] = { LOG_VERSION, 0 };
+		fwrite(magic, sizeof(magic), 1, out);
+		fwrite(version, sizeof(version), 1, out);
+	}
+}
+
+void CheckpointManager::set_period(uint64_t period)
+{
+	this->period = period;
+	// a repeat breakpoint is taken at less than total_exec >> 18
+	// executions, where total_exec is a little over the period, so the
+	// histories keep twice the first threshold; longer ones are rerun
+	history_limit = period >> 17;
+	if (history_limit < MemTrace::HISTORY_MIN) {
+		history_limit = MemTrace::HISTORY_MIN;
+	} else if (history_limit > MemTrace::HISTORY_MAX) {
+		history_limit = MemTrace::HISTORY_MAX;
+	}
+}
+
+void CheckpointManager::put_record(uint32_t type, const void *head,
+	size_t head_size, const void *tail, size_t tail_size)
+{
+	static const char zeros[8] = {};
+	uint32_t hdr[2] = { type, (uint32_t)(head_size + tail_size) };
+	fwrite(hdr, sizeof(hdr), 1, out);
+	fwrite(head, 1, head_size, out);
+	if (tail_size) {
+		fwrite(tail, 1, tail_size, out);
+	}
+	fwrite(zeros, 1, -(head_size + tail_size) & 7, out);
+}
+
+void CheckpointManager::put_trace(uint64_t kind, uint64_t value)
+{
+	uint64_t rec[2] = { kind, value };
+	if (::write(STDOUT_FILENO, rec, sizeof(rec)) != sizeof(rec)) {
+		::exit(-1);
+	}
+}
+
+void CheckpointManager::put_history(uint64_t addr, uint32_t count)
+{
+	// all but the current execution are needed, otherwise the
+	// breakpoint is left to a rerun
+	auto it = mem->histories.find(addr);
+	if (it == mem->histories.end() || it->second.size() + 1 != count) {
+		return;
+	}
+	if (binary) {
+		put_record(REC_HISTORY, it->second.data(),
+			it->second.size() * sizeof(HistRec));
+		return;
+	}
+	fprintf(out, "history");
+	for (auto &hist : it->second) {
+		fprintf(out, " %lu:%lx", hist.syscalls, hist.value);
+	}
+	fprintf(out, "\n");
+}
+
+void CheckpointManager::put_break(uint64_t addr, uint32_t kind,
+	uint32_t times, int32_t rd)
+{
+	if (!binary) {
+		static const char *kinds[] = { "ecall", "first", "firstrvc" };
+		if (kind == BREAK_REPEAT) {
+			fprintf(out, "break 0x%lx repeat %u %d\n", addr, times, rd);
+		} else {
+			fprintf(out, "break 0x%lx %s\n", addr, kinds[kind]);
+		}
+		return;
+	}
+	struct { uint64_t addr; uint32_t kind; int32_t rd; uint64_t times; }
+		rec = { addr, kind, rd, times };
+	put_record(REC_BREAK, &rec, sizeof(rec));
+}
+
 void CheckpointManager::break_here(uint64_t instret)
 {
 	std::string filename;
@@ -645,8 +748,18 @@ void CheckpointManager::break_here(uint64_t instret)
 		fprintf(stderr, "%s: %s\n", filepath.c_str(), strerror(errno));
 		::exit(-1);
 	}
-	fprintf(out, "file %s\n", filename.c_str());
-	mem->dump(dump_file, out);
+	if (binary) {
+		std::vector<uint64_t> page_pns, exec_pns;
+		put_record(REC_FILE, filename.data(), filename.size());
+		mem->dump(dump_file, page_pns, exec_pns);
+		put_record(REC_PAGES, page_pns.data(),
+			page_pns.size() * sizeof(uint64_t));
+		put_record(REC_EXECS, exec_pns.data(),
+			exec_pns.size() * sizeof(uint64_t));
+	} else {
+		fprintf(out, "file %s\n", filename.c_str());
+		mem->dump(dump_file, out);
+	}
 	fclose(dump_file);
 
 	// dump store trace
@@ -659,6 +772,12 @@ void CheckpointManager::break_here(uint64_t instret)
 				case 4: data = *(uint32_t *)mem->stores[i].addr; break;
 				case 8: data = *(uint64_t *)mem->stores[i].addr; break;
 			}
+			if (binary) {
+				uint64_t rec[3] = { mem->stores[i].addr,
+					mem->stores[i].size, data };
+				put_record(REC_STORE, rec, sizeof(rec));
+				continue;
+			}
 			fprintf(out, "store 0x%lx %0*lx\n", mem->stores[i].addr,
 				(int)(mem->stores[i].size * 2), data);
 		}
@@ -670,6 +789,19 @@ void CheckpointManager::break_here(uint64_t instret)
 void CheckpointManager::syscall(uint64_t retval, void *addr, size_t size)
 {
 	if (mem) {
+		mem->syscalls++;
+	}
+	if (mem && binary) {
+		uint64_t rec[3] = { syscall_pc, retval, (uint64_t)addr };
+		if (addr) {
+			for (size_t i = 0; i < size; i++) {
+				mem->store((uint64_t)addr + i, (char)0);
+			}
+			put_record(REC_SYSCALL, rec, sizeof(rec), addr, size);
+		} else {
+			put_record(REC_SYSCALL, rec, sizeof(uint64_t) * 2);
+		}
+	} else if (mem) {
 		fprintf(out, " %lx", retval);
 		if (addr) {
 			fprintf(out, " %p ", addr);
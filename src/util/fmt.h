@@ -213,6 +213,11 @@ namespace riscv {
 		StoreRec() : addr(0), size(0) {}
 	};
 
+	struct HistRec {
+		uint64_t syscalls;  // completed before this execution
+		uint64_t value;
+	};
+
 	template <class P>
 	struct PtrCache {
 		uint64_t idx;
@@ -229,6 +234,18 @@ namespace riscv {
 		PtrCache<PageRec> fetch_cache, load_cache;
 		PtrCache<ExecRec> exec_cache;
 
+		// results of rarely executed instructions, which may become
+		// a repeat breakpoint; see CheckpointManager::set_period for
+		// how rarely. Each record costs 16 bytes, so past
+		// HISTORY_RECORDS in total (16 MiB) no more are recorded, and
+		// the breakpoints missing some are left to a rerun.
+		enum { HISTORY_MIN = 64, HISTORY_MAX = 4096 };
+		enum { HISTORY_RECORDS = 1 << 20 };
+		std::unordered_map<uint64_t, std::vector<HistRec>> histories;
+		uint64_t history_records = 0;
+		uint64_t syscalls = 0;
+		uint32_t last_count = 0;  // executions of the last fetched pc
+
 		PageRec* get_page(uint64_t pn) {
 			PageRec *&page = pages[pn];
 			if (page == NULL) {
@@ -280,8 +297,23 @@ namespace riscv {
 			return false;
 		}
 
+		void add_history(uint64_t addr, uint64_t value) {
+			if (history_records < HISTORY_RECORDS) {
+				histories[addr].push_back({ syscalls, value });
+				history_records++;
+			}
+		}
+
+		void drop_history(uint64_t addr) {
+			auto it = histories.find(addr);
+			if (it != histories.end()) {
+				history_records -= it->second.size();
+				histories.erase(it);
+			}
+		}
+
 		bool fetch(uint64_t addr, uint64_t inst, int length) {
-			get_exec_counter(addr)++;
+			last_count = ++get_exec_counter(addr);
 			uint64_t pn = addr >> 12;
 			PageRec *page = get_page(pn, fetch_cache);
 			int offset = addr & 0xfff;
@@ -355,6 +387,8 @@ namespace riscv {
 		}
 
 		void dump(FILE *dump_file, FILE *cfg_file);
+		void dump(FILE *dump_file, std::vector<uint64_t> &page_pns,
+			std::vector<uint64_t> &exec_pns);
 
 		~MemTrace() {
 			for (auto &page : pages) {
@@ -370,19 +404,74 @@ namespace riscv {
 		FILE *out;
 		char *dirname;
 		uint64_t period;
+		uint64_t history_limit;
+		uint64_t history_pc;  // of the last fetch, if its results count
 		uint64_t begin_instret;
 		MemTrace *mem;
 		uint64_t monitor_pc;
+		uint64_t monitor_limit;
+		uint64_t monitor_count;
+		bool binary;
+		uint64_t syscall_pc;
 
 		enum {
 			ECALL = 0x00000073
 		};
 
+		// Binary log: a magic and version, then records of a 32-bit
+		// type, a 32-bit payload size and the payload padded to 8 bytes.
+		// See ckpt/parse.py for the payload of each record.
+		enum {
+			LOG_VERSION = 1
+		};
+		enum {
+			REC_BEGIN = 1,
+			REC_SYSCALL = 2,
+			REC_EXIT = 3,
+			REC_BREAK = 4,
+			REC_FILE = 5,
+			REC_PAGES = 6,
+			REC_EXECS = 7,
+			REC_STORE = 8,
+			REC_HISTORY = 9
+		};
+		// Monitor trace: 16-byte records of a kind and a value written
+		// to stdout, in order with what the guest writes there
+		enum {
+			TRACE_EXECUTE = 1,
+			TRACE_SYSCALL = 2,
+			TRACE_STOP = 3
+		};
+		enum {
+			BREAK_ECALL = 0,
+			BREAK_FIRST = 1,
+			BREAK_FIRSTRVC = 2,
+			BREAK_REPEAT = 3
+		};
+
+		void open(const char *path, bool binary);
+		void set_period(uint64_t period);
+		void put_record(uint32_t type, const void *head, size_t head_size,
+			const void *tail = NULL, size_t tail_size = 0);
+		void put_break(uint64_t addr, uint32_t kind,
+			uint32_t times = 0, int32_t rd = 0);
+		void put_trace(uint64_t kind, uint64_t value);
+		void put_history(uint64_t addr, uint32_t count);
+
 		template <typename P, typename T>
 		void fetch(P &proc, T &dec, uint64_t addr, uint64_t inst, int length) {
 			if (out) {
 				// begin new checkpoint
-				if (!mem) {
+				if (!mem && binary) {
+					mem = new MemTrace;
+					begin_instret = proc.instret;
+					uint64_t rec[65] = { addr };
+					for (int i = 0; i < 32; i++) {
+						rec[i + 1] = proc.ireg[i];
+						rec[i + 33] = proc.freg[i].r.xu.val;
+					}
+					put_record(REC_BEGIN, rec, sizeof(rec));
+				} else if (!mem) {
 					mem = new MemTrace;
 					begin_instret = proc.instret;
 					fprintf(out, "begin 0x%lx\n", addr);
@@ -398,6 +487,9 @@ namespace riscv {
 				}
 
 				bool first_visit = mem->fetch(addr, inst ,length);
+				// only a 4-byte instruction can be a repeat breakpoint,
+				// so execute() records the results of those only
+				history_pc = length == 4 ? addr : 0;
 
 				// look for breakpoint
 				// The breakpoint instruction is not executed between
@@ -406,20 +498,20 @@ namespace riscv {
 				if (proc.instret - begin_instret > period) {
 					// ecall
 					if (inst == ECALL) {
-						fprintf(out, "break 0x%lx ecall\n", addr);
+						put_break(addr, BREAK_ECALL);
 						break_here(proc.instret);
 						return;
 					}
 					// first met instruction
 					if (first_visit && length == 4) {
-						fprintf(out, "break 0x%lx first\n", addr);
+						put_break(addr, BREAK_FIRST);
 						break_here(proc.instret);
 						return;
 					}
 					// first met instruction (rvc)
 					if (first_visit && length == 2 &&
 						mem->prefetch(addr + 2, 2)) {
-						fprintf(out, "break 0x%lx firstrvc\n", addr);
+						put_break(addr, BREAK_FIRSTRVC);
 						break_here(proc.instret);
 						return;
 					}
@@ -429,8 +521,8 @@ namespace riscv {
 						uint32_t exec_count = mem->get_exec_counter(addr);
 						uint64_t total_exec = proc.instret - begin_instret;
 						if (exec_count < (total_exec >> 18)) {
-							fprintf(out, "break 0x%lx repeat %u %d\n",
-								addr, exec_count, rd);
+							put_history(addr, exec_count);
+							put_break(addr, BREAK_REPEAT, exec_count, rd);
 							break_here(proc.instret);
 							return;
 						}
@@ -441,7 +533,10 @@ namespace riscv {
 				// This output line is expected to be completed with
 				// a return value
 				if (inst == ECALL) {
-					fprintf(out, "syscall 0x%lx", addr);
+					syscall_pc = addr;
+					if (!binary) {
+						fprintf(out, "syscall 0x%lx", addr);
+					}
 				}
 			}
 		}
@@ -450,9 +545,27 @@ namespace riscv {
 
 		template <typename P, typename T>
 		void execute(P &proc, T &dec, uint64_t addr) {
+			// the count was taken by fetch(), which saves a lookup on
+			// every instruction; still, the first history_limit
+			// executions of each pc pay for get_rd() and a record
+			if (mem && addr == history_pc) {
+				uint32_t count = mem->last_count;
+				int rd;
+				if (count <= history_limit &&
+					(rd = proc.get_rd(dec)) > 0) {
+					mem->add_history(addr, (uint64_t)proc.ireg[rd]);
+				} else if (count == history_limit + 1) {
+					mem->drop_history(addr);
+				}
+			}
 			if (addr == monitor_pc) {
-				printf("execute %lx\n", (uint64_t)proc.ireg[dec.rd]);
-				fflush(stdout);
+				// stop right at the limit, which is the breakpoint
+				if (++monitor_count == monitor_limit) {
+					put_trace(TRACE_STOP, monitor_count);
+					::exit(0);
+				}
+				// the same register as the history records
+				put_trace(TRACE_EXECUTE, proc.ireg[proc.get_rd(dec)]);
 			}
 		}
 
@@ -475,7 +588,12 @@ namespace riscv {
 
 		template <typename P>
 		void exit(P &proc, int rc) {
-			if (mem) {
+			if (mem && binary) {
+				uint64_t rec[2] = { syscall_pc, (uint64_t)(uint32_t)rc };
+				put_record(REC_EXIT, rec, sizeof(rec));
+				break_here(proc.instret);
+				fclose(out);
+			} else if (mem) {
 				fprintf(out, " %x exit\n", rc);
 				break_here(proc.instret);
 				fclose(out);